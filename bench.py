@@ -0,0 +1,425 @@
+# Benchmark suite of game loop
+# Runs scripted scenarios through real simulation, sprites and drawing
+# on dummy display and reports speed, frame times and memory
+# Every scenario runs in own process, so peak RSS belongs to scenario
+#
+# Example:
+#     python bench.py --save-baseline baseline.json
+#     python bench.py --baseline baseline.json --json results.json
+#     python bench.py --scenarios 'bullet_storm*' --frames 1200
+#     python bench.py --replays replays/*.replay --scenarios 'replay:*'
+
+import argparse
+import fnmatch
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import pygame
+
+import main
+
+START_DIR = main.setup_headless()
+
+# Frames of allocation pass(it is slow because of tracemalloc)
+ALLOCATION_FRAMES = 300
+
+
+def init_display():
+    # Function of dummy display, sounds and images initialization
+    main.init_subsystems()
+    main.screen = pygame.display.set_mode(main.SCREEN_SIZE)
+
+    # Explosions are animated by pygame.time.get_ticks, it stays 0
+    # without SDL timer, and explosion scenarios would measure
+    # frozen animations
+    start = pygame.time.get_ticks()
+    pygame.time.wait(2)
+    if pygame.time.get_ticks() == start:
+        raise RuntimeError('SDL timer is not running')
+    main.audio.init()
+    main.assets.preload()
+    main.get_level_library()
+
+
+class Loop:
+    # Game loop without window events and waiting of clock
+    # Every frame simulates one step and draws it
+
+    def __init__(self, sim):
+        self.sim = sim
+        self.booms = pygame.sprite.Group()
+        self.start_round()
+
+    def start_round(self):
+        # Function for drawing background of new round
+        self.round = self.sim.round
+        main.clear_booms(self.booms)
+        self.renderer = main.RoundRenderer(main.screen, self.sim)
+        self.renderer.draw_full()
+
+    def frame(self, *masks):
+        # Function of one frame of game
+        events = self.sim.step(*masks)
+        main.play_events(events, self.booms, self.renderer.is_visible)
+        self.booms.update()
+        if self.sim.round != self.round:
+            self.start_round()
+        self.renderer.draw(self.sim, self.booms)
+
+    def close(self):
+        # Function for returning sprites of loop to pools
+        main.clear_booms(self.booms)
+        self.sim.close()
+
+
+def time_frames(frames, frame, loop):
+    # Function for measuring time of every frame in seconds
+    # Loop is closed after last frame
+    times = []
+    try:
+        for _ in range(frames):
+            start = time.perf_counter()
+            frame()
+            times.append(time.perf_counter() - start)
+    finally:
+        loop.close()
+    return times
+
+
+def free_cells(level):
+    # Function for getting centers of cells without blocks
+    return [((x + 0.5) * main.CELL_SIZE, (y + 0.5) * main.CELL_SIZE)
+            for y in range(level.rows) for x in range(level.cols)
+            if not level.is_blocked(x, y)]
+
+
+def live_bullets(sim):
+    # Function for getting count of bullets in round
+    if sim.bullet_arrays is not None:
+        return sim.bullet_arrays.count
+    return len(sim.bullets)
+
+
+def bullet_storm(frames, seed, level, bullets, bullet_arrays=False):
+    # Scenario of many live bullets, destroyed bullets are replaced
+    # Tanks are removed from round, so round doesn't end
+    sim = main.Simulation(seed, [level], bullet_arrays=bullet_arrays)
+    sim.tanks.empty()
+    loop = Loop(sim)
+    rand = random.Random(seed)
+    cells = free_cells(sim.level)
+    owner = sim.tank_1
+
+    def frame():
+        while live_bullets(sim) < bullets:
+            # Bullets fly by angles of gun's rotations like in game
+            angle = rand.randrange(main.GUN_FRAMES) * 360 / main.GUN_FRAMES
+            sim.spawn_bullet(list(rand.choice(cells)), owner.bullet_speed,
+                             angle, owner)
+        loop.frame()
+
+    return time_frames(frames, frame, loop)
+
+
+def level_match(frames, seed, level, bullet_arrays=False):
+    # Scenario of match of random players on one level
+    sim = main.Simulation(seed, [level], bullet_arrays=bullet_arrays)
+    loop = Loop(sim)
+    players = [main.RandomPlayer(seed * 2), main.RandomPlayer(seed * 2 + 1)]
+
+    def frame():
+        loop.frame(players[0].get_mask(), players[1].get_mask())
+
+    return time_frames(frames, frame, loop)
+
+
+def bot_match(frames, seed, level, players=2, bullet_arrays=False):
+    # Scenario of match of bots on one level, navigation tables
+    # of level are computed in scenario
+    sim = main.Simulation(seed, [level], bullet_arrays=bullet_arrays,
+                          players=players)
+    loop = Loop(sim)
+    bots = [main.BotController(sim, player, seed * players + player)
+            for player in range(players)]
+
+    def frame():
+        loop.frame(*[bot.get_mask() for bot in bots])
+
+    return time_frames(frames, frame, loop)
+
+
+def explosion_chain(frames, seed, level, per_frame=3, max_booms=300,
+                    bullet_arrays=False):
+    # Scenario of many explosions with sounds, new explosions start
+    # near previous ones every frame
+    sim = main.Simulation(seed, [level], bullet_arrays=bullet_arrays)
+    loop = Loop(sim)
+    rand = random.Random(seed)
+    kinds = sorted(main.HIT_EFFECTS)
+    center = [main.width / 2, main.height / 2]
+
+    def frame():
+        if len(loop.booms) < max_booms:
+            events = []
+            for _ in range(per_frame):
+                center[0] = (center[0] + rand.uniform(-60, 60)) % main.width
+                center[1] = (center[1] + rand.uniform(-60, 60)) % main.height
+                events.append((rand.choice(kinds), tuple(center), None))
+            main.play_events(events, loop.booms)
+        loop.frame()
+
+    return time_frames(frames, frame, loop)
+
+
+def round_restart(frames, seed, level_names=None, bullet_arrays=False):
+    # Scenario of starting new round every frame on random levels
+    # level_names parameter - levels of rounds(all levels if None)
+    sim = main.Simulation(seed, level_names, bullet_arrays=bullet_arrays)
+    loop = Loop(sim)
+
+    def frame():
+        sim.new_round()
+        loop.start_round()
+        loop.frame()
+
+    return time_frames(frames, frame, loop)
+
+
+def replay_match(frames, seed, path, bullet_arrays=False):
+    # Scenario of recorded match, seed of scenario isn't used
+    # Scenario ends with replay, if replay is shorter than frames
+    replay = main.Replay.load(path)
+    replay.check_levels()
+    sim = main.Simulation(replay.seed, replay.level_names,
+                          bullet_arrays=bullet_arrays, players=replay.players)
+    loop = Loop(sim)
+    masks = replay.masks()
+
+    def frame():
+        loop.frame(*next(masks))
+
+    return time_frames(min(frames, replay.steps), frame, loop)
+
+
+def make_scenarios(storm_bullets, replays=()):
+    # Function for getting dict of scenarios by names
+    # Scenario - (function, parameters)
+    levels = sorted(main.get_level_list())
+    scenarios = {}
+    for bullets in storm_bullets:
+        scenarios[f'bullet_storm_{bullets}'] = (
+            bullet_storm, {'level': levels[0], 'bullets': bullets}
+        )
+    for level in levels:
+        scenarios['level:' + os.path.splitext(level)[0]] = (
+            level_match, {'level': level}
+        )
+        scenarios['bots:' + os.path.splitext(level)[0]] = (
+            bot_match, {'level': level}
+        )
+        # Levels with more spawns are played by all tanks too
+        spawns = len(main.get_level_library().get(level).spawns)
+        if spawns > 2:
+            scenarios[f'bots_{spawns}:' + os.path.splitext(level)[0]] = (
+                bot_match, {'level': level, 'players': spawns}
+            )
+    scenarios['explosion_chain'] = (explosion_chain, {'level': levels[0]})
+    scenarios['round_restart'] = (round_restart, {})
+    # Generated levels are new in every round
+    scenarios['round_restart:generated'] = (
+        round_restart, {'level_names': [main.GENERATED_LEVELS]}
+    )
+    scenarios['bots:generated'] = (
+        bot_match, {'level': main.GENERATED_LEVELS}
+    )
+    for path in replays:
+        scenarios['replay:' + os.path.splitext(os.path.basename(path))[0]] = (
+            replay_match, {'path': path}
+        )
+    return scenarios
+
+
+def percentile(times, point):
+    # Function for getting percentile of sorted list
+    return times[min(len(times) - 1, int(len(times) * point / 100))]
+
+
+def run_scenario(name, frames, seed, storm_bullets, replays, bullet_arrays):
+    # Function of running one scenario in worker process
+    init_display()
+    function, parameters = make_scenarios(storm_bullets, replays)[name]
+    parameters = dict(parameters, bullet_arrays=bullet_arrays)
+
+    # Timing pass
+    gc.collect()
+    collections = sum(stat['collections'] for stat in gc.get_stats())
+    start = time.perf_counter()
+    times = function(frames, seed, **parameters)
+    seconds = time.perf_counter() - start
+    frames = len(times)
+    collections = sum(stat['collections'] for stat in gc.get_stats()) \
+        - collections
+
+    # Allocation pass
+    gc.collect()
+    tracemalloc.start()
+    function(min(frames, ALLOCATION_FRAMES), seed, **parameters)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Peak resident memory(ru_maxrss is in KiB on Linux, in bytes on macOS)
+    peak_rss = None
+    if resource is not None:
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin':
+            peak_rss //= 1024
+
+    times.sort()
+    return {
+        'frames': frames,
+        'seconds': seconds,
+        'fps': frames / seconds,
+        'mean_ms': seconds / frames * 1000,
+        'p50_ms': percentile(times, 50) * 1000,
+        'p95_ms': percentile(times, 95) * 1000,
+        'p99_ms': percentile(times, 99) * 1000,
+        'max_ms': times[-1] * 1000,
+        'gc_collections': collections,
+        'alloc_peak_kib': peak / 1024,
+        'alloc_retained_kib': current / 1024,
+        'peak_rss_kib': peak_rss,
+        'bullet_pool': main.bullet_pool.stats(),
+        'explosion_pool': main.explosion_pool.stats(),
+    }
+
+
+def run_scenarios(names, frames, seed, storm_bullets, replays,
+                  bullet_arrays):
+    # Function for running scenarios one by one in new processes
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for name in names:
+        with ProcessPoolExecutor(1, mp_context=context) as executor:
+            results[name] = executor.submit(
+                run_scenario, name, frames, seed, storm_bullets, replays,
+                bullet_arrays
+            ).result()
+        print_result(name, results[name])
+    return results
+
+
+def compare(results, baseline, tolerance):
+    # Function for finding regressions relative to baseline
+    # Returns list of (scenario, metric, baseline value, value)
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result['fps'] < base['fps'] * (1 - tolerance):
+            regressions.append((name, 'fps', base['fps'], result['fps']))
+        for metric in ('p95_ms', 'p99_ms', 'alloc_peak_kib'):
+            if result[metric] > base[metric] * (1 + tolerance):
+                regressions.append((name, metric, base[metric],
+                                    result[metric]))
+    return regressions
+
+
+def print_header():
+    print(f'{"scenario":<20}{"fps":>9}{"p50 ms":>9}{"p95 ms":>9}'
+          f'{"p99 ms":>9}{"max ms":>9}{"gc":>5}{"alloc KiB":>11}'
+          f'{"RSS KiB":>10}')
+
+
+def print_result(name, result):
+    rss = result['peak_rss_kib']
+    print(f'{name:<20}{result["fps"]:>9.1f}{result["p50_ms"]:>9.2f}'
+          f'{result["p95_ms"]:>9.2f}{result["p99_ms"]:>9.2f}'
+          f'{result["max_ms"]:>9.2f}{result["gc_collections"]:>5}'
+          f'{result["alloc_peak_kib"]:>11.0f}'
+          f'{"-" if rss is None else rss:>10}', flush=True)
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark SquareTanks game loop on dummy display.'
+    )
+    parser.add_argument('--scenarios', nargs='*', default=['*'],
+                        help='patterns of scenario names(all by default)')
+    parser.add_argument('--list', action='store_true',
+                        help='print names of scenarios and exit')
+    parser.add_argument('--frames', type=int, default=600,
+                        help='frames of every scenario')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of scenarios')
+    parser.add_argument('--storm-bullets', type=int, nargs='*',
+                        default=[100, 500],
+                        help='counts of bullets in bullet storms')
+    parser.add_argument('--replays', nargs='*', default=[],
+                        help='replay files, which are played as scenarios')
+    parser.add_argument('--bullet-arrays', action='store_true',
+                        help='use NumPy bullet arrays')
+    parser.add_argument('--json', help='file for results in JSON')
+    parser.add_argument('--baseline', help='JSON file of baseline results')
+    parser.add_argument('--save-baseline',
+                        help='file for saving results as baseline')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='allowed relative regression to baseline')
+    args = parser.parse_args(argv)
+
+    replays = [os.path.join(START_DIR, path) for path in args.replays]
+    names = [name for name in make_scenarios(args.storm_bullets, replays)
+             if any(fnmatch.fnmatch(name, pattern)
+                    for pattern in args.scenarios)]
+    if args.list:
+        print('\n'.join(names))
+        return 0
+
+    print_header()
+    results = run_scenarios(names, args.frames, args.seed,
+                            args.storm_bullets, replays, args.bullet_arrays)
+    report = {
+        'python': platform.python_version(),
+        'pygame': pygame.version.ver,
+        'platform': platform.platform(),
+        'frames': args.frames,
+        'seed': args.seed,
+        'bullet_arrays': args.bullet_arrays,
+        'scenarios': results,
+    }
+
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(os.path.join(START_DIR, path), 'w') as file:
+                json.dump(report, file, indent=2)
+
+    if args.baseline:
+        with open(os.path.join(START_DIR, args.baseline)) as file:
+            baseline = json.load(file)['scenarios']
+        regressions = compare(results, baseline, args.tolerance)
+        print()
+        if not regressions:
+            print('No regressions relative to baseline')
+            return 0
+        print(f'{"scenario":<20}{"metric":>16}{"baseline":>12}{"now":>12}')
+        for name, metric, base, value in regressions:
+            print(f'{name:<20}{metric:>16}{base:>12.2f}{value:>12.2f}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
@@ -0,0 +1,92 @@
+# Generator of level files
+# Generates levels by seeds, checks them and saves levels with good score
+# to folder of levels
+#
+# Example:
+#     python levelgen.py --count 10
+#     python levelgen.py --count 50 --seed 1000 --min-score 0.95
+#     python levelgen.py --count 5 --cols 30 --rows 14 --out my_levels
+
+import argparse
+import os
+import sys
+import time
+
+import main
+
+START_DIR = main.setup_headless()
+
+
+def generate_level(generator, seed):
+    # Function for generating level by seed
+    # Returns lines of level and its score(None if no candidate is good)
+    candidate = generator.pick(seed)
+    if candidate is None:
+        return None, None
+    score, grid, spawns = candidate
+    return generator.to_lines(grid, spawns), score
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Generate SquareTanks level files.'
+    )
+    parser.add_argument('--count', type=int, default=10,
+                        help='count of saved levels')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of first level')
+    parser.add_argument('--candidates', type=int, default=64,
+                        help='count of checked candidates for level')
+    parser.add_argument('--min-score', type=float, default=0.9,
+                        help='min score of saved level(0-1)')
+    parser.add_argument('--cols', type=int, default=24,
+                        help='width of level in cells')
+    parser.add_argument('--rows', type=int, default=12,
+                        help='height of level in cells')
+    parser.add_argument('--out',
+                        help='folder for level files(levels of game '
+                             'by default)')
+    parser.add_argument('--prefix', default='gen_',
+                        help='prefix of names of level files')
+    parser.add_argument('--max-tries', type=int, default=1000,
+                        help='max count of generated levels for one '
+                             'saved level')
+    args = parser.parse_args(argv)
+    if args.cols < 4 or args.rows < 2:
+        parser.error('level must be at least 4x2 cells')
+
+    generator = main.LevelGenerator(args.cols, args.rows, args.candidates)
+    if args.out is None:
+        out = os.path.join(main.GAME_DIR, main.LEVELS_DIR)
+    else:
+        out = os.path.join(START_DIR, args.out)
+    os.makedirs(out, exist_ok=True)
+
+    start = time.perf_counter()
+    saved = 0
+    seed = args.seed
+    # Generation stops, if score can't be reached
+    while saved < args.count and \
+            seed - args.seed < args.count * args.max_tries:
+        lines, score = generate_level(generator, seed)
+        if score is not None and score >= args.min_score:
+            name = f'{args.prefix}{seed}.txt'
+            # Level files have no newline at end
+            with open(os.path.join(out, name), 'w') as file:
+                file.write('\n'.join(lines))
+            print(f'{name:<20}score {score:.3f}')
+            saved += 1
+        seed += 1
+    seconds = time.perf_counter() - start
+
+    tried = seed - args.seed
+    print(f'{saved} of {tried} levels saved in {seconds:.2f} s, '
+          f'{tried * args.candidates / seconds:.0f} candidates/s')
+    if saved < args.count:
+        print(f'Only {saved} of {args.count} levels reached score '
+              f'{args.min_score}')
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
@@ -1,29 +1,102 @@
-import pygame
 import math
 import os
 import sys
 import random
+import struct
+import csv
+import time
+import threading
+import zlib
+from collections import OrderedDict, deque
 
-pygame.init()
+# Time of start of loading of game for measuring startup
+# (pygame is imported after it, because its import is slow)
+START_TIME = time.perf_counter()
+
+import pygame  # noqa: E402
+
+# NumPy is optional, it is needed only for bullet arrays,
+# it is imported at first use, because its import is slow
+numpy = None
 
 # Program settings
 FPS = 60
 
+# Simulation steps per second, simulation runs with fixed time step
+# and doesn't depend on FPS of drawing
+TICK_RATE = 60
+TICK = 1 / TICK_RATE
+
+# Max time of frame for simulation, after longer frames(freezes)
+# simulation isn't trying to catch up whole time
+MAX_FRAME_TIME = 0.25
+
 SCREEN_SIZE = (1800, 900)
 width = SCREEN_SIZE[0]
 height = SCREEN_SIZE[1]
 
 clock = pygame.time.Clock()
 
-COLORS = ['green', 'red']
+COLORS = ['green', 'red', 'blue', 'yellow']
+
+# Color of game field
+BACKGROUND_COLOR = (125, 200, 255)
+
+# Size of level's cell in pixels
+CELL_SIZE = 75
+
+# Folder of game, levels and images are loaded by paths relative to it
+GAME_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Folder of levels and cache file of compiled levels
+LEVELS_DIR = 'levels'
+LEVEL_CACHE_FILE = os.path.join(LEVELS_DIR, '.compiled')
+
+# Name of generated levels in list of levels and prefix of names
+# of generated levels(prefix is followed by seed in hex)
+GENERATED_LEVELS = 'generated'
+GENERATED_PREFIX = 'generated_'
+
+# Sizes of tank's body and bullet's image in pixels
+TANK_SIZE = 50
+BULLET_SIZE = (8, 14)
+
+# Count of precomputed tank's gun rotations
+# (gun rotates by rotate_speed / TICK_RATE = 3 degrees per step)
+GUN_FRAMES = 120
+# Count of tank's body orientations
+BODY_FRAMES = 4
+
+# Count of explosion animation frames and sizes of explosions in game
+EXPLOSION_FRAMES = 9
+EXPLOSION_SIZES = [0.2, 0.3, 1]
 
-screen = pygame.display.set_mode(SCREEN_SIZE)
+# Max counts of free bullets and explosions, which are kept for reusing
+BULLET_POOL_SIZE = 256
+EXPLOSION_POOL_SIZE = 128
 
-# Load sounds
-BOOM_SOUND = pygame.mixer.Sound('data/boom_sound.wav')
-SHOT_SOUND = pygame.mixer.Sound('data/shot_sound.wav')
-MUSIC = pygame.mixer.Sound('data/music.wav')
-RELOAD_SOUND = pygame.mixer.Sound('data/reload_sound.wav')
+# Key of showing and hiding frame profiler overlay
+PROFILER_KEY = pygame.K_F3
+
+# Music file, it is streamed from disk while it plays
+MUSIC_FILE = 'data/music.wav'
+
+# Sound effects by names
+SOUND_FILES = {
+    'boom': 'data/boom_sound.wav',
+    'shot': 'data/shot_sound.wav',
+    'reload': 'data/reload_sound.wav',
+}
+
+# Count of mixer channels, which are reserved for sound effects
+EFFECT_CHANNELS = 8
+# Min time between plays of one effect in milliseconds
+# (louder play isn't limited)
+EFFECT_INTERVAL = 30
+
+# Display is created by init_game function,
+# so module can be imported for headless simulation
+screen = None
 
 
 # Function for calculating sin(from degrees)
@@ -41,6 +114,38 @@ def hypotenuse(a, b):
     return math.sqrt(a ** 2 + b ** 2)
 
 
+# Function for calculating size of rectangle's bounding box after rotation
+def rotated_size(size, angle):
+    w = abs(size[0] * cos(angle)) + abs(size[1] * sin(angle))
+    h = abs(size[0] * sin(angle)) + abs(size[1] * cos(angle))
+    return int(round(w, 6)), int(round(h, 6))
+
+
+# Function for finding time of collision of moving rectangle with box
+# Rectangle (x, y, w, h) moves by (dx, dy), box is (bx, by, bw, bh)
+# Returns part of moving(0..1), when rectangles start overlapping
+# (like pygame.Rect.colliderect, touching isn't collision) or None
+def sweep_time(x, y, w, h, dx, dy, bx, by, bw, bh):
+    enter = 0.0
+    leave = 1.0
+    for pos, size, d, box_pos, box_size in ((x, w, dx, bx, bw),
+                                            (y, h, dy, by, bh)):
+        if d == 0:
+            # Without moving rectangles must overlap on this axis
+            if pos + size <= box_pos or pos >= box_pos + box_size:
+                return None
+        else:
+            t1 = (box_pos - pos - size) / d
+            t2 = (box_pos + box_size - pos) / d
+            if t1 > t2:
+                t1, t2 = t2, t1
+            enter = max(enter, t1)
+            leave = min(leave, t2)
+            if enter >= leave:
+                return None
+    return enter
+
+
 # Function for image loading
 def load_image(name, colorkey=None):
     # Find path to image and load it
@@ -58,15 +163,169 @@ def load_image(name, colorkey=None):
     return image
 
 
+class AssetCache:
+    # Process-wide cache of decoded images and their derived variants
+    # Cache is filled by preloading thread, while main thread draws
+    # start screen, so images are built outside of lock and only
+    # finished images are published(first published image is kept,
+    # if both threads build the same image)
+
+    def __init__(self):
+        # Decoded and converted images by (name, colorkey)
+        self.images = {}
+        # Derived images (rotated, scaled, ...) by variant key
+        self.variants = {}
+        self.lock = threading.Lock()
+
+    def image(self, name, colorkey=None):
+        # Function for getting shared image, file is decoded only once
+        key = (name, colorkey)
+        image = self.images.get(key)
+        if image is None:
+            image = load_image(name, colorkey)
+            with self.lock:
+                image = self.images.setdefault(key, image)
+        return image
+
+    def variant(self, key, build):
+        # Function for getting shared derived image
+        # key parameter - unique key of variant
+        # build parameter - function, which creates variant on first call
+        variant = self.variants.get(key)
+        if variant is None:
+            variant = build()
+            with self.lock:
+                variant = self.variants.setdefault(key, variant)
+        return variant
+
+    def rotated(self, name, angle, colorkey=None):
+        # Function for getting image rotated by angle(in degrees)
+        # Angle is rounded to step of gun's rotations, so other angles
+        # don't add new images to cache
+        step = 360 / GUN_FRAMES
+        angle = round(angle / step) % GUN_FRAMES * step
+        return self.variant(
+            ('rotated', name, colorkey, angle),
+            lambda: pygame.transform.rotate(self.image(name, colorkey), angle)
+        )
+
+    def scaled(self, name, size, colorkey=None):
+        # Function for getting image scaled to size
+        size = tuple(size)
+        return self.variant(
+            ('scaled', name, colorkey, size),
+            lambda: pygame.transform.scale(self.image(name, colorkey), size)
+        )
+
+    def rotations(self, name, count, colorkey=None):
+        # Function for getting table of image rotated by 360 / count steps
+        # Every item is (image, rect centered at (0, 0))
+        def build():
+            table = []
+            for i in range(count):
+                image = pygame.transform.rotate(self.image(name, colorkey),
+                                                i * 360 / count)
+                table.append((image, image.get_rect(center=(0, 0))))
+            return table
+
+        return self.variant(('rotations', name, colorkey, count), build)
+
+    def explosion(self, size):
+        # Function for getting explosion animation scaled with ratio "size"
+        def build():
+            frames = []
+            for i in range(EXPLOSION_FRAMES):
+                image = self.image(f'explosion ({i + 1}).png', -1)
+                frames.append(pygame.transform.scale(
+                    image, [int(s * size) for s in image.get_size()]
+                ))
+            return frames
+
+        return self.variant(('explosion', size), build)
+
+    def preload(self):
+        # Function for decoding all game images before first round
+        self.image('block.png')
+        for color in COLORS:
+            self.rotations(f'tank_body_{color}.png', BODY_FRAMES)
+            self.rotations(f'tank_barrel_{color}.png', GUN_FRAMES, 0)
+            self.image(f'bullet_{color}.png', -1)
+        for size in EXPLOSION_SIZES:
+            self.explosion(size)
+
+
+assets = AssetCache()
+
+
+class SpritePool:
+    # Free sprites of one class, which are reused instead of creating
+    # new ones, pool keeps capacity of free sprites at most
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.free = []
+
+        # Count of sprites in game and its max value
+        self.live = 0
+        self.high_water = 0
+
+        # Counts of created and reused sprites
+        self.created = 0
+        self.reused = 0
+
+    def take(self):
+        # Function for getting free sprite(None if pool is empty)
+        self.live += 1
+        self.high_water = max(self.high_water, self.live)
+        if self.free:
+            self.reused += 1
+            return self.free.pop()
+        self.created += 1
+        return None
+
+    def give(self, sprite):
+        # Function for returning sprite, which isn't used, to pool
+        # Links of sprite are broken, so free sprite doesn't keep
+        # simulation of finished match alive
+        self.live -= 1
+        sprite.release()
+        if len(self.free) < self.capacity:
+            self.free.append(sprite)
+
+    def stats(self):
+        # Function for getting statistics of pool
+        return {
+            'capacity': self.capacity,
+            'free': len(self.free),
+            'live': self.live,
+            'high_water': self.high_water,
+            'created': self.created,
+            'reused': self.reused,
+        }
+
+
+# Pools of bullets and explosions
+bullet_pool = SpritePool(BULLET_POOL_SIZE)
+explosion_pool = SpritePool(EXPLOSION_POOL_SIZE)
+
+
 # Function for getting level's list
-def get_level_list():
-    return os.listdir('levels')
+# players parameter - only levels with spawns for all players are listed
+def get_level_list(players=2):
+    library = get_level_library()
+    return [name for name in library.get_names()
+            if has_spawns(library.get(name), players)]
+
+
+# Function for checking if level has spawns for all players
+def has_spawns(level, players):
+    return all(str(player + 1) in level.spawns for player in range(players))
 
 
 # Function for loading levels
-def load_level(filename):
+def load_level(filename, path=LEVELS_DIR):
     # Create full path to level
-    filename = "levels/" + filename
+    filename = os.path.join(path, filename)
 
     # Open and read level file
     with open(filename, 'r') as level_file:
@@ -79,10 +338,676 @@ def load_level(filename):
     return list(map(lambda x: x.ljust(max_width, '0'), level_map))
 
 
+class CompiledLevel:
+    # Level compiled from text file for fast starting of rounds
+
+    def __init__(self, name, mtime, cols, rows, blocked, spawns):
+        self.name = name
+        # Modification time of level file(in nanoseconds)
+        self.mtime = mtime
+
+        # Level size in cells
+        self.cols = cols
+        self.rows = rows
+
+        # Map of blocked cells by rows, one byte for cell
+        self.blocked = bytes(blocked)
+
+        # Cells of tank's spawns by digits of level file
+        self.spawns = spawns
+
+        # Cells and rectangles of blocks(rectangles are shared by blocks
+        # of all rounds on level, blocks never move)
+        self.block_cells = [(i % cols, i // cols)
+                            for i, cell in enumerate(self.blocked) if cell]
+        self.block_rects = [
+            pygame.Rect(x * CELL_SIZE, y * CELL_SIZE, CELL_SIZE, CELL_SIZE)
+            for x, y in self.block_cells
+        ]
+
+    @classmethod
+    def from_map(cls, name, mtime, level_map):
+        # Function for compiling level from list of level's lines
+        cols = len(level_map[0]) if level_map else 0
+        rows = len(level_map)
+        blocked = bytearray(cols * rows)
+        spawns = {}
+        for y, line in enumerate(level_map):
+            for x, cell in enumerate(line):
+                if cell == '*':
+                    blocked[y * cols + x] = 1
+                elif cell.isdigit() and cell != '0':
+                    spawns[cell] = (x, y)
+        return cls(name, mtime, cols, rows, blocked, spawns)
+
+    def is_blocked(self, x, y):
+        # Function for checking if cell (x, y) contains block
+        if 0 <= x < self.cols and 0 <= y < self.rows:
+            return self.blocked[y * self.cols + x] == 1
+        return False
+
+    def pack(self):
+        # Function for packing level to bytes for cache file
+        # Blocked cells are packed to bits
+        name = self.name.encode()
+        bits = bytearray((len(self.blocked) + 7) // 8)
+        for i, cell in enumerate(self.blocked):
+            if cell:
+                bits[i // 8] |= 1 << i % 8
+
+        data = struct.pack('<H', len(name)) + name
+        data += struct.pack('<qHHH', self.mtime, self.cols, self.rows,
+                            len(self.spawns))
+        for digit, (x, y) in sorted(self.spawns.items()):
+            data += struct.pack('<cHH', digit.encode(), x, y)
+        return data + bytes(bits)
+
+    def checksum(self):
+        # Function for getting checksum of level's cells and spawns
+        data = struct.pack('<HH', self.cols, self.rows) + self.blocked
+        for digit, (x, y) in sorted(self.spawns.items()):
+            data += struct.pack('<cHH', digit.encode(), x, y)
+        return zlib.crc32(data)
+
+    @classmethod
+    def unpack(cls, data, offset=0):
+        # Function for unpacking level from bytes of cache file
+        # Returns level and offset after level's data
+        name_length, = struct.unpack_from('<H', data, offset)
+        offset += 2
+        name = data[offset:offset + name_length].decode()
+        offset += name_length
+
+        mtime, cols, rows, spawns_count = struct.unpack_from('<qHHH', data,
+                                                             offset)
+        offset += struct.calcsize('<qHHH')
+        spawns = {}
+        for _ in range(spawns_count):
+            digit, x, y = struct.unpack_from('<cHH', data, offset)
+            offset += struct.calcsize('<cHH')
+            spawns[digit.decode()] = (x, y)
+
+        bits_length = (cols * rows + 7) // 8
+        bits = data[offset:offset + bits_length]
+        offset += bits_length
+        blocked = bytes((bits[i // 8] >> i % 8) & 1 for i in range(cols * rows))
+        return cls(name, mtime, cols, rows, blocked, spawns), offset
+
+
+class LevelGenerator:
+    # Seeded generator of levels in format of level files
+    # Candidates are built on bit grid(bit of cell is 1 for block),
+    # checked for reachability of spawns by flood fill of bit grid
+    # and scored by symmetry and cover, best candidate is taken
+    # Levels have SPAWNS spawns: second spawn is mirror of first one
+    # around center, third and fourth are its mirrors around middle lines
+
+    # Version of generator, levels with the same seed are the same
+    # only in the same version
+    VERSION = 2
+    SPAWNS = 4
+
+    def __init__(self, cols=24, rows=12, candidates=64, symmetry=0.85,
+                 density=(0.12, 0.35)):
+        # candidates parameter - count of checked candidates for level
+        # symmetry parameter - chance of mirroring of wall
+        # density parameter - min and max part of blocked cells
+        self.cols = cols
+        self.rows = rows
+        self.candidates = candidates
+        self.symmetry = symmetry
+        self.density = density
+
+        # Masks of all cells and of cells, which aren't in first or
+        # last column(for shifts of grid by one cell left or right)
+        self.cells = cols * rows
+        self.full = (1 << self.cells) - 1
+        first_column = sum(1 << (y * cols) for y in range(rows))
+        self.not_first = self.full & ~first_column
+        self.not_last = self.full & ~(first_column << (cols - 1))
+
+    def generate(self, seed):
+        # Function for generating level by seed
+        # Returns lines of level file
+        best = self.pick(seed)
+        if best is None:
+            # Empty level with spawns in corners
+            best = (0, 0, self.get_spawns(0, 0))
+        score, grid, spawns = best
+        return self.to_lines(grid, spawns)
+
+    def pick(self, seed):
+        # Function for choosing best of candidates by seed
+        # Returns best candidate or None, if all candidates are bad
+        rand = random.Random(seed)
+        best = None
+        for _ in range(self.candidates):
+            candidate = self.make_candidate(rand)
+            if candidate is not None and (best is None or
+                                          candidate[0] > best[0]):
+                best = candidate
+        return best
+
+    def get_spawns(self, x, y):
+        # Function for getting cells of spawns by cell of first spawn
+        cols, rows = self.cols, self.rows
+        return [y * cols + x, (rows - 1 - y) * cols + cols - 1 - x,
+                y * cols + cols - 1 - x, (rows - 1 - y) * cols + x]
+
+    def make_candidate(self, rand):
+        # Function for making and checking one candidate
+        # Returns (score, grid, cells of spawns) or None for bad candidate
+        cols, rows = self.cols, self.rows
+        last = self.cells - 1
+
+        # Walls are placed by random segments, most of them are mirrored
+        # around center of level
+        grid = 0
+        for _ in range(rand.randint(8, 16)):
+            x = rand.randrange(cols)
+            y = rand.randrange(rows)
+            length = rand.randint(1, 5)
+            if rand.random() < 0.5:
+                cells = [y * cols + i for i in range(x, min(x + length, cols))]
+            else:
+                cells = [i * cols + x for i in range(y, min(y + length, rows))]
+            mirrored = rand.random() < self.symmetry
+            for cell in cells:
+                grid |= 1 << cell
+                if mirrored:
+                    grid |= 1 << (last - cell)
+
+        # Spawns are in first and last quarters of level and not
+        # in middle row, so mirrored spawns don't match
+        y = rand.randrange(rows // 2)
+        if rand.random() < 0.5:
+            y = rows - 1 - y
+        spawns = self.get_spawns(rand.randrange(cols // 4), y)
+        spawn_1, spawn_2 = spawns[:2]
+        spawn_bits = sum(1 << spawn for spawn in spawns)
+        grid &= ~spawn_bits
+
+        # All spawns must be reachable from first one,
+        # unreachable cells are filled by blocks
+        free = self.full & ~grid
+        reach, distance = self.flood(1 << spawn_1, free, 1 << spawn_2)
+        if reach & spawn_bits != spawn_bits:
+            return None
+        grid |= free & ~reach
+        free = reach
+
+        blocks = bin(grid).count('1')
+        density = blocks / self.cells
+        if not self.density[0] <= density <= self.density[1]:
+            return None
+
+        # Symmetry - part of blocks, which have mirrored block
+        mirror = int(format(grid, f'0{self.cells}b')[::-1], 2)
+        symmetry = bin(grid & mirror).count('1') / blocks
+
+        # Cover - part of free cells near blocks, it is best near half
+        near = (grid << 1 & self.not_first) | (grid >> 1 & self.not_last) | \
+            grid << cols | grid >> cols
+        cover = bin(near & free).count('1') / bin(free).count('1')
+
+        # Detour - how much way between spawns is longer than straight way
+        x_1, y_1 = spawn_1 % cols, spawn_1 // cols
+        x_2, y_2 = spawn_2 % cols, spawn_2 // cols
+        detour = distance / max(abs(x_2 - x_1) + abs(y_2 - y_1), 1) - 1
+
+        score = 0.4 * symmetry + 0.4 * (1 - abs(cover - 0.5) * 2) + \
+            0.2 * min(detour * 4, 1)
+        return score, grid, spawns
+
+    def flood(self, start, free, target):
+        # Function of breadth-first search on bit grid, all cells of front
+        # are moved by one step at once
+        # Returns reached cells and steps to target(None if unreachable)
+        cols = self.cols
+        reach = start
+        distance = None
+        steps = 0
+        while True:
+            grown = reach | (reach << 1 & self.not_first) | \
+                (reach >> 1 & self.not_last) | reach << cols | reach >> cols
+            grown &= free
+            if grown == reach:
+                return reach, distance
+            reach = grown
+            steps += 1
+            if distance is None and reach & target:
+                distance = steps
+
+    def to_lines(self, grid, spawns):
+        # Function for converting grid to lines of level file
+        cells = ['*' if grid >> i & 1 else '0' for i in range(self.cells)]
+        for i, spawn in enumerate(spawns):
+            cells[spawn] = str(i + 1)
+        return [''.join(cells[y * self.cols:(y + 1) * self.cols])
+                for y in range(self.rows)]
+
+
+class LevelLibrary:
+    # Compiled levels of folder
+    # Levels are compiled again, when modification time of file changes,
+    # and can be saved to binary cache file for next starts
+
+    # Header of cache file
+    CACHE_MAGIC = b'STLC'
+    CACHE_VERSION = 1
+
+    # Count of kept generated levels
+    GENERATED_CACHE_SIZE = 8
+
+    def __init__(self, path=LEVELS_DIR, cache_file=None):
+        self.path = path
+        self.cache_file = cache_file
+
+        # Compiled levels by names
+        self.levels = {}
+
+        # Generated levels by names(in order of use) and threads,
+        # which generate levels in background
+        self.generator = LevelGenerator()
+        self.generated = OrderedDict()
+        self.generating = {}
+        self.generated_lock = threading.Lock()
+
+        # Sorted names of levels and folder's modification time
+        self.names = []
+        self.path_mtime = None
+
+        if cache_file is not None:
+            self.load_cache()
+        self.refresh()
+
+    def refresh(self):
+        # Function for compiling new and changed levels, if folder changed
+        path_mtime = os.stat(self.path).st_mtime_ns
+        if path_mtime == self.path_mtime:
+            return
+        self.path_mtime = path_mtime
+
+        self.names = sorted(name for name in os.listdir(self.path)
+                            if name.endswith('.txt'))
+        changed = False
+        for name in self.names:
+            changed |= self.compile(name)
+
+        # Forget deleted levels
+        for name in set(self.levels) - set(self.names):
+            del self.levels[name]
+            changed = True
+
+        if changed:
+            self.save_cache()
+
+    def compile(self, name):
+        # Function for compiling level, if it isn't compiled or changed
+        # Returns True, if level was compiled
+        mtime = os.stat(os.path.join(self.path, name)).st_mtime_ns
+        level = self.levels.get(name)
+        if level is not None and level.mtime == mtime:
+            return False
+        self.levels[name] = CompiledLevel.from_map(
+            name, mtime, load_level(name, self.path)
+        )
+        return True
+
+    def get(self, name):
+        # Function for getting compiled level by name
+        if name.startswith(GENERATED_PREFIX):
+            return self.get_generated(name)
+        if self.compile(name):
+            self.save_cache()
+        return self.levels[name]
+
+    def get_generated(self, name):
+        # Function for getting generated level by name
+        # Level is generated by seed from name, if it isn't in cache
+        thread = self.generating.get(name)
+        if thread is not None:
+            thread.join()
+        with self.generated_lock:
+            level = self.generated.get(name)
+            if level is not None:
+                self.generated.move_to_end(name)
+                return level
+        return self.generate(name)
+
+    def generate(self, name):
+        # Function for generating level and saving it to cache
+        seed = int(name[len(GENERATED_PREFIX):], 16)
+        level = CompiledLevel.from_map(name, 0, self.generator.generate(seed))
+        with self.generated_lock:
+            self.generated[name] = level
+            self.generated.move_to_end(name)
+            while len(self.generated) > self.GENERATED_CACHE_SIZE:
+                self.generated.popitem(last=False)
+            self.generating.pop(name, None)
+        return level
+
+    def prefetch(self, name):
+        # Function of starting generation of level in background,
+        # so it is ready at start of round
+        with self.generated_lock:
+            if name in self.generated or name in self.generating:
+                return
+            thread = self.generating[name] = threading.Thread(
+                target=self.generate, args=(name,), name='generate',
+                daemon=True
+            )
+        thread.start()
+
+    def checksum(self, name):
+        # Function for getting checksum of level for replays
+        # Generated levels depend on version of generator only
+        if name == GENERATED_LEVELS:
+            return LevelGenerator.VERSION
+        return self.get(name).checksum()
+
+    def get_names(self):
+        # Function for getting sorted list of level's names
+        self.refresh()
+        return self.names
+
+    def save_cache(self):
+        # Function for saving compiled levels to cache file
+        if self.cache_file is None:
+            return
+        data = bytearray(self.CACHE_MAGIC)
+        data += struct.pack('<HH', self.CACHE_VERSION, len(self.levels))
+        for name in sorted(self.levels):
+            data += self.levels[name].pack()
+
+        # File is replaced at once, so it is never read half-written
+        temp_file = self.cache_file + '.tmp'
+        with open(temp_file, 'wb') as file:
+            file.write(data)
+        os.replace(temp_file, self.cache_file)
+        # Saving cache file can change folder's modification time
+        self.path_mtime = os.stat(self.path).st_mtime_ns
+
+    def load_cache(self):
+        # Function for loading compiled levels from cache file
+        # Broken or old cache file is ignored
+        try:
+            with open(self.cache_file, 'rb') as file:
+                data = file.read()
+            if data[:4] != self.CACHE_MAGIC:
+                return
+            version, count = struct.unpack_from('<HH', data, 4)
+            if version != self.CACHE_VERSION:
+                return
+            offset = 8
+            levels = {}
+            for _ in range(count):
+                level, offset = CompiledLevel.unpack(data, offset)
+                levels[level.name] = level
+        except (OSError, struct.error, UnicodeDecodeError, IndexError):
+            return
+        self.levels = levels
+
+
+# Level library of game, it is created at first use
+# (by preloading thread or by main thread)
+level_library = None
+level_library_lock = threading.Lock()
+
+
+def get_level_library(cache_file=None):
+    # Function for getting level library of game
+    # cache_file parameter - cache file for library, library, which is
+    # created without cache file, starts saving to it
+    global level_library
+    with level_library_lock:
+        if level_library is None:
+            level_library = LevelLibrary(LEVELS_DIR, cache_file)
+        elif cache_file is not None and \
+                cache_file != level_library.cache_file:
+            if level_library.cache_file is not None:
+                raise ValueError(f'Level library uses cache file '
+                                 f'{level_library.cache_file}')
+            level_library.cache_file = cache_file
+            level_library.save_cache()
+    return level_library
+
+
+class LevelNavigation:
+    # Navigation tables of level for bots
+    # Flow fields and lines of sight are computed at first use
+    # and kept, so bot's decision is several lookups
+
+    # Offsets of checked lines from cells' centers(in cells)
+    SIGHT_OFFSETS = [(0, 0), (-0.2, -0.2), (0.2, -0.2), (-0.2, 0.2),
+                     (0.2, 0.2)]
+
+    def __init__(self, level):
+        self.cols = level.cols
+        self.rows = level.rows
+        self.blocked = level.blocked
+
+        # Free neighbours of cells with move bits to them
+        self.neighbours = [self.get_neighbours(cell)
+                           for cell in range(self.cols * self.rows)]
+
+        # Flow fields by target cells and line of sight tables
+        # by source cells(0 - unknown, 1 - visible, 2 - hidden cell)
+        self.flows = {}
+        self.sights = {}
+
+    def get_neighbours(self, cell):
+        # Function for getting free neighbours of cell and move bits to them
+        x, y = cell % self.cols, cell // self.cols
+        neighbours = []
+        for command, (dx, dy) in (('move/up', (0, -1)),
+                                  ('move/left', (-1, 0)),
+                                  ('move/down', (0, 1)),
+                                  ('move/right', (1, 0))):
+            nx, ny = x + dx, y + dy
+            if 0 <= nx < self.cols and 0 <= ny < self.rows and \
+                    not self.blocked[ny * self.cols + nx]:
+                neighbours.append((ny * self.cols + nx, COMMAND_BITS[command]))
+        return neighbours
+
+    def cell_at(self, x, y):
+        # Function for getting cell by point in pixels
+        # Returns None for points out of level
+        col, row = int(x // CELL_SIZE), int(y // CELL_SIZE)
+        if 0 <= col < self.cols and 0 <= row < self.rows:
+            return row * self.cols + col
+        return None
+
+    def flow(self, target):
+        # Function for getting flow field to target cell
+        # Flow field contains move bit of first step of shortest path
+        # for every cell(0 for target and unreachable cells)
+        field = self.flows.get(target)
+        if field is None:
+            field = bytearray(self.cols * self.rows)
+            # Breadth-first search from target, step of every reached cell
+            # is move to cell, from which it is reached
+            reached = bytearray(self.cols * self.rows)
+            reached[target] = 1
+            queue = deque([target])
+            while queue:
+                cell = queue.popleft()
+                for neighbour, bit in self.neighbours[cell]:
+                    if not reached[neighbour]:
+                        reached[neighbour] = 1
+                        field[neighbour] = OPPOSITE_MOVES[bit]
+                        queue.append(neighbour)
+            self.flows[target] = field
+        return field
+
+    def is_visible(self, source, target):
+        # Function for checking if target cell is visible from source cell
+        # Lines of sight are checked only for asked pairs of cells,
+        # so time of check doesn't depend on size of level
+        table = self.sights.get(source)
+        if table is None:
+            table = self.sights[source] = bytearray(self.cols * self.rows)
+        sight = table[target]
+        if not sight:
+            sight = table[target] = 1 if self.check_sight(source, target) \
+                else 2
+            other = self.sights.get(target)
+            if other is not None:
+                other[source] = sight
+        return sight == 1
+
+    def check_sight(self, source, target):
+        # Function for checking if lines between cells' centers and corners
+        # of squares around centers don't cross blocks, so bullet
+        # flies between cells with any deviation of tanks from centers
+        for dx, dy in self.SIGHT_OFFSETS:
+            if not self.check_line(source % self.cols + 0.5 + dx,
+                                   source // self.cols + 0.5 + dy,
+                                   target % self.cols + 0.5 + dx,
+                                   target // self.cols + 0.5 + dy):
+                return 0
+        return 1
+
+    def check_line(self, x1, y1, x2, y2):
+        # Function for checking if line(in cells) doesn't cross blocks
+        # Cells of line are walked by crossings of grid's lines,
+        # at crossing of grid's corner both side cells are checked
+        col, row = int(x1), int(y1)
+        dx, dy = x2 - x1, y2 - y1
+        step_x = 1 if dx > 0 else -1
+        step_y = 1 if dy > 0 else -1
+
+        # Parts of line to next crossings of vertical and horizontal
+        # grid's lines and between crossings
+        next_x = (col + (dx > 0) - x1) / dx if dx else math.inf
+        next_y = (row + (dy > 0) - y1) / dy if dy else math.inf
+        delta_x = abs(1 / dx) if dx else math.inf
+        delta_y = abs(1 / dy) if dy else math.inf
+
+        blocked = self.blocked
+        cols = self.cols
+        while min(next_x, next_y) < 1:
+            if next_x < next_y:
+                col += step_x
+                next_x += delta_x
+            elif next_y < next_x:
+                row += step_y
+                next_y += delta_y
+            else:
+                if blocked[row * cols + col + step_x] or \
+                        blocked[(row + step_y) * cols + col]:
+                    return False
+                col += step_x
+                row += step_y
+                next_x += delta_x
+                next_y += delta_y
+            if blocked[row * cols + col]:
+                return False
+        return True
+
+
+# Navigation tables of levels by names and modification times
+# (in order of use) and max count of kept tables
+navigation_cache = {}
+NAVIGATION_CACHE_SIZE = 16
+
+
+def get_navigation(level):
+    # Function for getting cached navigation tables of level
+    key = (level.name, level.mtime)
+    navigation = navigation_cache.pop(key, None)
+    if navigation is None:
+        navigation = LevelNavigation(level)
+    # Cache keeps recently used levels only, because generated levels
+    # are new in every round
+    navigation_cache[key] = navigation
+    while len(navigation_cache) > NAVIGATION_CACHE_SIZE:
+        del navigation_cache[next(iter(navigation_cache))]
+    return navigation
+
+
+class BlockGrid:
+    # Uniform grid index of level's blocks
+
+    def __init__(self, cols, rows):
+        # Grid size in cells
+        self.cols = cols
+        self.rows = rows
+        self.rect = pygame.Rect(0, 0, self.cols * CELL_SIZE,
+                                self.rows * CELL_SIZE)
+
+        # Flat list of cells, cell contains block or None
+        self.cells = [None] * (self.cols * self.rows)
+
+    def add(self, block, x, y):
+        # Function for placing block to cell (x, y)
+        self.cells[y * self.cols + x] = block
+
+    def is_blocked(self, x, y):
+        # Function for checking if cell (x, y) contains block
+        if 0 <= x < self.cols and 0 <= y < self.rows:
+            return self.cells[y * self.cols + x] is not None
+        return False
+
+    def cell_range(self, rect):
+        # Function for getting ranges of cells, which rect overlaps
+        x1 = max(rect.left // CELL_SIZE, 0)
+        x2 = min((rect.right - 1) // CELL_SIZE, self.cols - 1)
+        y1 = max(rect.top // CELL_SIZE, 0)
+        y2 = min((rect.bottom - 1) // CELL_SIZE, self.rows - 1)
+        return range(x1, x2 + 1), range(y1, y2 + 1)
+
+    def collide_rect(self, rect):
+        # Function for getting list of blocks, which collide with rect
+        collisions = []
+        x_range, y_range = self.cell_range(rect)
+        for y in y_range:
+            for x in x_range:
+                block = self.cells[y * self.cols + x]
+                if block is not None and rect.colliderect(block.rect):
+                    collisions.append(block)
+        return collisions
+
+    def sweep(self, x, y, w, h, dx, dy):
+        # Function for finding first block on the way of moving rectangle
+        # (x, y, w, h) - rectangle, (dx, dy) - moving of rectangle
+        # Blocked cells of region, which rectangle passes, are checked
+        # by ray from rectangle against cell expanded by rectangle's size
+        # Returns part of moving(0..1) before collision or None
+        x1 = max(int(min(x, x + dx) // CELL_SIZE), 0)
+        x2 = min(int(math.ceil(max(x, x + dx) + w) // CELL_SIZE),
+                 self.cols - 1)
+        y1 = max(int(min(y, y + dy) // CELL_SIZE), 0)
+        y2 = min(int(math.ceil(max(y, y + dy) + h) // CELL_SIZE),
+                 self.rows - 1)
+
+        first = None
+        for cell_y in range(y1, y2 + 1):
+            for cell_x in range(x1, x2 + 1):
+                if self.cells[cell_y * self.cols + cell_x] is None:
+                    continue
+                part = sweep_time(x, y, w, h, dx, dy,
+                                  cell_x * CELL_SIZE, cell_y * CELL_SIZE,
+                                  CELL_SIZE, CELL_SIZE)
+                if part is not None and (first is None or part < first):
+                    first = part
+        return first
+
+    def collide_any(self, rect):
+        # Function for getting first block, which collides with rect
+        x_range, y_range = self.cell_range(rect)
+        for y in y_range:
+            for x in x_range:
+                block = self.cells[y * self.cols + x]
+                if block is not None and rect.colliderect(block.rect):
+                    return block
+        return None
+
+
 # Class for border of game field
 class Border(pygame.sprite.Sprite):
-    def __init__(self, x1, y1, x2, y2, edge):
-        super().__init__(borders)
+    def __init__(self, x1, y1, x2, y2, edge, *groups):
+        super().__init__(groups)
         self.edge = edge
         if x1 == x2:
             self.rect = pygame.Rect(x1, y1, 1, y2 - y1)
@@ -92,18 +1017,31 @@ class Border(pygame.sprite.Sprite):
             self.plane = 1
 
 
+# Parameters of tank's move directions - (plane, direction, body angle)
+DIRECTIONS = {
+    'up': (1, -1, 270),
+    'down': (1, 1, 90),
+    'right': (0, 1, 180),
+    'left': (0, -1, 0),
+}
+
+
 # Class of the tank sprite
 class Tank(pygame.sprite.Sprite):
-    def __init__(self, pos, color, number, *groups):
+    def __init__(self, sim, pos, color, player, *groups):
         super().__init__(groups)
 
+        # Simulation, which contains tank
+        self.sim = sim
+
         # Tank's options
         self.rotate_speed = 180
         self.speed = 200
         self.reload_time = 1
         self.bullet_speed = 500
         self.color = color
-        self.number = number
+        # Index of tank's player
+        self.player = player
 
         # Changeable tank's options
         self.gun_angle = 0
@@ -112,32 +1050,26 @@ class Tank(pygame.sprite.Sprite):
 
         self.not_moved_in_frame = True
         self.destroyed = False
-        self.new_round_countdown = FPS * 2
-        self.orig_reload_frames = self.reload_time * FPS
+        self.new_round_countdown = TICK_RATE * 2
+        self.orig_reload_frames = self.reload_time * TICK_RATE
 
-        self.bullets = []
-
-        # Load tank's images
-        self.body_image = load_image(f'tank_body_{color}.png')
-        self.gun_image = load_image(f'tank_barrel_{color}.png', 0)
-
-        # Create tank's image and borders
-        self.body = pygame.transform.rotate(self.body_image,
-                                            (self.body_angle + 90) % 360)
-        self.rect = self.body.get_rect()
+        # Create tank's borders
+        # Coordinates are kept in float, rectangle has rounded coordinates
+        self.pos = list(pos)
+        self.rect = pygame.Rect(0, 0, TANK_SIZE, TANK_SIZE)
         self.rect.x, self.rect.y = pos
 
-        self.gun = self.gun_image.copy()
-        self.gun_rect = self.gun.get_rect(center=self.rect.center)
+        # Coordinates in previous step for interpolation of drawing
+        self.prev_pos = self.pos[:]
 
     # Function for gun rotating
     def rotate_gun(self, right=True):
         # right option - direction of rotating
         # (True - clockwise, False - counterclockwise)
         if right:
-            self.gun_angle = (self.gun_angle + self.rotate_speed / FPS) % 360
+            self.gun_angle = (self.gun_angle + self.rotate_speed * TICK) % 360
         else:
-            self.gun_angle = (self.gun_angle - self.rotate_speed / FPS) % 360
+            self.gun_angle = (self.gun_angle - self.rotate_speed * TICK) % 360
 
     # Function for tank's move
     def move(self, direction):
@@ -145,56 +1077,54 @@ class Tank(pygame.sprite.Sprite):
 
         # Check if tank not moved in frame
         if self.not_moved_in_frame:
-            # Словарь с параметрами для каждого из направлений движения
-            direction_dict = {
-                'up': {'plane': 1, 'direction': -1, 'angle': 270},
-                'down': {'plane': 1, 'direction': 1, 'angle': 90},
-                'right': {'plane': 0, 'direction': 1, 'angle': 180},
-                'left': {'plane': 0, 'direction': -1, 'angle': 0},
-            }
-
             # Get current direction parameters
-            direction_params = direction_dict[direction]
+            plane, sign, angle = DIRECTIONS[direction]
 
             # Edit tank's coordinates and body angle
-            self.rect[direction_params['plane']] += int(self.speed / FPS) * \
-                                                    direction_params['direction']
+            self.pos[plane] += self.speed * TICK * sign
+            self.rect.x, self.rect.y = self.pos
+            moved_coordinate = self.rect[plane]
 
-            self.body_angle = direction_params['angle']
+            self.body_angle = angle
 
             # Edit parameter for exclude situation
             # of more than one move in frame
             self.not_moved_in_frame = False
 
             # Check if tank have collision
-            collision_blocks = pygame.sprite.spritecollide(
-                self, obstacles, False
-            )
-
-            collision_blocks.remove(self)
+            collision_blocks = self.get_collisions()
 
             # If there is collision, start cycle
             # for return tank to start coordinates
             while collision_blocks:
                 # Start function for return tank to start coordinates
-                self.control_collision(collision_blocks[0],
-                                       direction_params['plane'])
+                self.control_collision(collision_blocks[0], plane)
 
                 # Check tank's collision
-                collision_blocks = pygame.sprite.spritecollide(
-                    self, obstacles, False
-                )
-
-                collision_blocks.remove(self)
+                collision_blocks = self.get_collisions()
 
             # Check tank's collision with borders
-            collision_border = pygame.sprite.spritecollide(self, borders, False)
+            collision_border = pygame.sprite.spritecollide(
+                self, self.sim.borders, False
+            )
 
             # If there is collision with borders,
             # return tank to start coordinates
             for collide in collision_border:
                 self.rect[collide.plane] = \
-                    (SCREEN_SIZE[collide.plane] - 50) * collide.edge
+                    (self.sim.size[collide.plane] - TANK_SIZE) * collide.edge
+
+            # If tank was returned, take coordinates from rectangle
+            if self.rect[plane] != moved_coordinate:
+                self.pos[plane] = self.rect[plane]
+
+    # Function for getting blocks and other tanks, which collide with tank
+    def get_collisions(self):
+        collisions = self.sim.grid.collide_rect(self.rect)
+        for tank in self.sim.tanks:
+            if tank is not self and self.rect.colliderect(tank.rect):
+                collisions.append(tank)
+        return collisions
 
     # Function for returning tank to start coordinates without collision
     def control_collision(self, collide, i):
@@ -203,33 +1133,40 @@ class Tank(pygame.sprite.Sprite):
         else:
             self.rect[i] = collide.rect[i] + collide.rect.size[i]
 
-    # Function for starting new round if tank is destroyed
+    # Function for checking if new round must be started
     def check_destroy(self):
         # Check if tank is destroyed
         if self.destroyed:
             # If countdown not equal 0 decrease countdown
             if self.new_round_countdown != 0:
                 self.new_round_countdown -= 1
-            # If countdown equal 0 start new round
+            # If countdown equal 0 new round must be started
             elif self.new_round_countdown == 0:
-                new_round()
+                return True
+        return False
 
     def action(self, command):
         # Function for pass commands to tank
         # command parameter - command for tank
         # command format - command/parameter
+        self.act(COMMAND_BITS[command])
+
+    def act(self, mask):
+        # Function for doing commands of mask
+        # Commands are done in order of TANK_COMMANDS, tank does only
+        # first move of mask
 
         # Check tank isn't destroyed
         if not self.destroyed:
-            # Separate command to command and perameter
-            command, parameter = command.split('/')
-
-            # Command doing
-            if command == 'move':
-                self.move(parameter)
-            elif command == 'rotate_gun':
-                self.rotate_gun({'true': True, 'false': False}[parameter])
-            elif command == 'fire':
+            moves = mask & MOVE_MASK
+            if moves:
+                # Lowest bit is first move
+                self.move(MOVE_DIRECTIONS[moves & -moves])
+            if mask & ROTATE_RIGHT_BIT:
+                self.rotate_gun(True)
+            if mask & ROTATE_LEFT_BIT:
+                self.rotate_gun(False)
+            if mask & FIRE_BIT:
                 self.fire()
 
     def update(self):
@@ -238,70 +1175,26 @@ class Tank(pygame.sprite.Sprite):
             # Update parameter for checking if tank moved in current frame
             self.not_moved_in_frame = True
 
-            # Edit tank's image by direction
-            self.body = pygame.transform.rotate(
-                self.body_image, (self.body_angle + 90) % 360
-            )
-
-            # Edit gun's image and gun's rectangle by direction
-            self.gun = pygame.transform.rotate(self.gun_image, self.gun_angle)
-            self.gun_rect = self.gun.get_rect(center=self.rect.center)
-
             # Reduce frame's count to gun reload
             if self.reload_frames > 0:
                 self.reload_frames -= 1
 
-            # Get all bullet's without own
-            frame_bullets = bullets.copy()
-            for i in self.bullets:
-                frame_bullets.remove(i)
-
-            # Check if tank collides with bullets
-            bullets_collide = pygame.sprite.spritecollideany(self, frame_bullets)
-            if bullets_collide:
-                # If tank collides with bullets, start boom function
-                bullets_collide.destroy()
-                self.boom()
-
-    def boom(self):
+    def boom(self, killer=None):
         # Tank destroying function
-
-        # Boom sound playing
-        BOOM_SOUND.set_volume(1)
-        BOOM_SOUND.play()
+        # killer parameter - tank, which fired bullet
 
         # Switch variable of tank's destroying
         self.destroyed = True
 
-        # Start explosion animation
-        Explosion(self.rect.center, 1)
-
-        # Create empty function - stub
-        def destroyed_draw(surface):
-            pass
-
-        # Drawing functions replace with empty function
-        self.draw_body = destroyed_draw
-        self.draw_gun = destroyed_draw
+        # Report about explosion
+        self.sim.emit('tank_hit', self.rect.center, self)
 
         # Delete sprites from lists of sprites
-        tanks.remove(self)
-        obstacles.remove(self)
-
-        # Increase player's score
-        global player_1_score, player_2_score
-        if self.number == 1:
-            player_1_score += 1
-        if self.number == 2:
-            player_2_score += 1
-
-    def draw_body(self, surface):
-        # Function for drawing tank's body
-        surface.blit(self.body, self.rect)
+        self.sim.tanks.remove(self)
 
-    def draw_gun(self, surface):
-        # Function for drawing tank's gun
-        surface.blit(self.gun, self.gun_rect)
+        # Increase score of killer's player
+        if killer is not None:
+            self.sim.scores[killer.player] += 1
 
     def fire(self):
         # Fire function
@@ -314,35 +1207,54 @@ class Tank(pygame.sprite.Sprite):
             # Calculate bullet's coordinates
             x = self.rect.center[0] - 5 - sin(self.gun_angle) * 40
             y = self.rect.center[1] - 5 - cos(self.gun_angle) * 40
-            self.bullets.append(
-                Bullet(
-                    [x, y],
-                    self.bullet_speed,
-                    270 - self.gun_angle,
-                    self.color
-                )
+            self.sim.spawn_bullet(
+                [x, y],
+                self.bullet_speed,
+                270 - self.gun_angle,
+                self
             )
 
-            # Play shot sound
-            SHOT_SOUND.play()
+            # Report about shot
+            self.sim.emit('shot', self)
 
 
 class Block(pygame.sprite.Sprite):
     # Block class
-    def __init__(self, pos, *groups):
+    def __init__(self, rect, *groups):
         # Function of block initialization
+        # rect parameter - precompiled rectangle of block's cell
         super().__init__(groups)
-        self.image = load_image('block.png')
-        self.rect = self.image.get_rect()
-        self.rect.x, self.rect.y = pos[0] * self.rect[2], pos[1] * self.rect[3]
+        self.rect = rect
 
 
 class Bullet(pygame.sprite.Sprite):
     # Bullet class
 
-    def __init__(self, pos, v, vector, color):
+    def __init__(self, sim, pos, v, vector, color, owner):
         # Function of bullet initialization
-        super().__init__(bullets)
+        super().__init__()
+        self.rect = pygame.Rect(0, 0, 0, 0)
+        self.reset(sim, pos, v, vector, color, owner)
+
+    @classmethod
+    def spawn(cls, sim, pos, v, vector, color, owner):
+        # Function for creating bullet or taking free bullet from pool
+        bullet = bullet_pool.take()
+        if bullet is None:
+            return cls(sim, pos, v, vector, color, owner)
+        bullet.reset(sim, pos, v, vector, color, owner)
+        return bullet
+
+    def reset(self, sim, pos, v, vector, color, owner):
+        # Function for setting parameters of new bullet
+        sim.bullets.add(self)
+
+        # Simulation, which contains bullet
+        self.sim = sim
+
+        # Tank, which fired bullet
+        self.owner = owner
+        self.color = color
 
         # Calculate velocity of bullet
         self.v = v
@@ -352,72 +1264,606 @@ class Bullet(pygame.sprite.Sprite):
         self.pos = pos
         self.vector = vector
 
-        # Create bullet's image and bullet's rectangle
-        self.image = pygame.transform.rotate(
-            load_image(f'bullet_{color}.png', -1), 270 - vector
-        )
-
-        self.rect = self.image.get_rect()
+        # Angle of bullet's image and bullet's rectangle
+        self.angle = 270 - vector
+        self.rect.size = rotated_size(BULLET_SIZE, self.angle)
         self.rect.x, self.rect.y = self.pos
 
+        # Coordinates in previous step for interpolation of drawing
+        self.prev_pos = self.pos[:]
+
     def update(self):
-        # Function for updating bullet with new frame
+        # Function for updating bullet with new step
+        self.prev_pos = self.pos[:]
+
+        # Find first block on bullet's way in this step
+        dx = self.v_x * TICK
+        dy = self.v_y * TICK
+        hit = self.sim.grid.sweep(self.pos[0], self.pos[1],
+                                  self.rect.w, self.rect.h, dx, dy)
 
         # Update bullet's coordinates
-        self.pos[0] += self.v_x / FPS
-        self.pos[1] += self.v_y / FPS
+        # (bullet stops at block, so it never passes through block)
+        part = 1 if hit is None else hit
+        self.pos[0] += dx * part
+        self.pos[1] += dy * part
         self.rect.x, self.rect.y = self.pos
 
         # Check if bullet collides with blocks
-        if pygame.sprite.spritecollideany(self, blocks):
+        if hit is not None:
+            # Report about explosion
+            self.sim.emit('block_hit', self.rect.center)
+
             # Destroy bullet
             self.destroy()
 
-            # Play muted boom sound
-            BOOM_SOUND.set_volume(0.1)
-            BOOM_SOUND.play()
+        # Destroy bullet if it left game field
+        elif not self.sim.grid.rect.colliderect(self.rect):
+            self.destroy()
 
-            # Start explosion animation
-            Explosion(self.rect.center, 0.2)
+    def destroy(self):
+        # Function of bullet destoroying, bullet returns to pool
+        self.sim.bullets.remove(self)
+        bullet_pool.give(self)
+
+    def release(self):
+        # Function for breaking links of free bullet
+        self.sim = None
+        self.owner = None
+
+
+def find_collision_pairs(bullets, tanks):
+    # Function of broad phase for bullets and tanks collisions
+    # Sprites are sorted by left edge and swept from left to right,
+    # so only sprites with overlapping x intervals are compared
+    # Returns lists of pairs (bullet, bullet) and (bullet, tank)
+    bullet_pairs = []
+    tank_pairs = []
+
+    sprites = sorted([*bullets, *tanks], key=lambda sprite: sprite.rect.x)
+    active = []
+    for sprite in sprites:
+        left = sprite.rect.left
+        # Drop sprites, which ended before current sprite
+        active = [other for other in active if other.rect.right > left]
+
+        is_bullet = isinstance(sprite, Bullet)
+        for other in active:
+            if not sprite.rect.colliderect(other.rect):
+                continue
+            if is_bullet and isinstance(other, Bullet):
+                bullet_pairs.append((other, sprite))
+            elif is_bullet:
+                # Tank isn't hit by own bullets
+                if sprite.owner is not other:
+                    tank_pairs.append((sprite, other))
+            elif isinstance(other, Bullet):
+                if other.owner is not sprite:
+                    tank_pairs.append((other, sprite))
+
+        active.append(sprite)
+
+    return bullet_pairs, tank_pairs
+
+
+def load_numpy():
+    # Function of importing NumPy at first use
+    global numpy
+    if numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError('NumPy is required for bullet arrays')
+
+
+# Function for rounding coordinates like pygame.Rect(half away from zero)
+def round_coordinates(values):
+    return numpy.where(values >= 0, numpy.floor(values + 0.5),
+                       numpy.ceil(values - 0.5)).astype(int)
+
+
+class BulletArrays:
+    # Bullets of round stored in NumPy arrays(struct of arrays)
+    # All bullets are moved and checked for collisions by one batch step
+    # Bullet's rectangle is position rounded like pygame.Rect
+    # and size of rotated bullet's image
+
+    def __init__(self, sim, capacity=64):
+        load_numpy()
+
+        self.sim = sim
+
+        # Count of live bullets, they are stored at start of arrays
+        self.count = 0
+
+        # Bullet's parameters
+        self.pos = numpy.zeros((capacity, 2))
+        self.prev_pos = numpy.zeros((capacity, 2))
+        self.velocity = numpy.zeros((capacity, 2))
+        self.size = numpy.zeros((capacity, 2), dtype=int)
+        self.angle = numpy.zeros(capacity)
+        self.owner = numpy.zeros(capacity, dtype=int)
+        self.alive = numpy.zeros(capacity, dtype=bool)
+
+        # Tanks, which fired bullets, by owner index
+        self.owners = []
+        self.owner_index = {}
+
+        # Map of blocked cells of level
+        level = sim.level
+        self.blocked = numpy.frombuffer(level.blocked, dtype=numpy.uint8) \
+            .reshape(level.rows, level.cols).astype(bool)
+
+    def grow(self):
+        # Function for doubling capacity of arrays
+        for name in ('pos', 'prev_pos', 'velocity', 'size', 'angle',
+                     'owner', 'alive'):
+            array = getattr(self, name)
+            new_array = numpy.zeros((len(array) * 2,) + array.shape[1:],
+                                    dtype=array.dtype)
+            new_array[:self.count] = array[:self.count]
+            setattr(self, name, new_array)
+
+    def add(self, pos, v, vector, owner):
+        # Function for adding bullet fired by owner tank
+        if self.count == len(self.alive):
+            self.grow()
+
+        if owner not in self.owner_index:
+            self.owner_index[owner] = len(self.owners)
+            self.owners.append(owner)
+
+        i = self.count
+        angle = 270 - vector
+        self.pos[i] = pos
+        self.prev_pos[i] = pos
+        self.velocity[i] = (v * cos(vector), v * sin(vector))
+        self.size[i] = rotated_size(BULLET_SIZE, angle)
+        self.angle[i] = angle
+        self.owner[i] = self.owner_index[owner]
+        self.alive[i] = True
+        self.count += 1
+
+    def rects(self):
+        # Function for getting arrays of live bullet's rectangles borders
+        left, top = round_coordinates(self.pos[:self.count]).T
+        right = left + self.size[:self.count, 0]
+        bottom = top + self.size[:self.count, 1]
+        return left, top, right, bottom
+
+    def find_block_candidates(self, step):
+        # Function for finding bullets, which can meet block in this step
+        # Region, which bullet passes, is checked by its corner cells,
+        # bullets with regions bigger than 3x3 cells are always checked
+        grid = self.sim.grid
+        pos = self.pos[:self.count]
+        size = self.size[:self.count]
+
+        candidates = numpy.zeros(self.count, dtype=bool)
+        cells = []
+        for axis, count in ((0, grid.cols), (1, grid.rows)):
+            low = numpy.minimum(pos[:, axis], pos[:, axis] + step[:, axis])
+            high = numpy.maximum(pos[:, axis], pos[:, axis] + step[:, axis])
+            cell_1 = numpy.clip(low // CELL_SIZE, 0, count - 1).astype(int)
+            cell_2 = numpy.clip(numpy.ceil(high + size[:, axis]) // CELL_SIZE,
+                                0, count - 1).astype(int)
+            candidates |= cell_2 - cell_1 > 2
+            cells.append((cell_1, cell_2))
+
+        (x1, x2), (y1, y2) = cells
+        for i in range(3):
+            for j in range(3):
+                candidates |= self.blocked[numpy.minimum(y1 + j, y2),
+                                           numpy.minimum(x1 + i, x2)]
+        return candidates
 
-        # Check if bullet collides with other bullets
-        bullet_collide = pygame.sprite.spritecollide(self, bullets, False)
-        if self in bullet_collide:
-            bullet_collide.remove(self)
+    def update(self):
+        # Function for updating all bullets with new step
+        n = self.count
+        if n == 0:
+            return
+        grid = self.sim.grid
+        self.prev_pos[:n] = self.pos[:n]
+
+        # Find first blocks on bullet's ways in this step,
+        # only bullets near blocks are checked by exact sweep
+        step = self.velocity[:n] * TICK
+        parts = numpy.ones(n)
+        hit = numpy.zeros(n, dtype=bool)
+        for i in numpy.flatnonzero(self.find_block_candidates(step)).tolist():
+            part = grid.sweep(self.pos[i, 0], self.pos[i, 1],
+                              self.size[i, 0], self.size[i, 1],
+                              step[i, 0], step[i, 1])
+            if part is not None:
+                parts[i] = part
+                hit[i] = True
 
-        # If bullet collides with other bullets
-        if bullet_collide:
-            # Destroy bullets
-            bullet_collide[0].destroy()
-            self.destroy()
+        # Update bullet's coordinates
+        # (bullet stops at block, so it never passes through block)
+        self.pos[:n] += step * parts[:, None]
+        left, top, right, bottom = self.rects()
+        alive = self.alive[:n]
+
+        # Destroy bullets, which met blocks
+        alive &= ~hit
+        for i in numpy.flatnonzero(hit):
+            self.emit_hit('block_hit', i, left, top)
+
+        # Destroy bullets, which left game field
+        field = grid.rect
+        alive &= ((left < field.right) & (right > field.left) &
+                  (top < field.bottom) & (bottom > field.top))
+
+        # Check collisions of bullets with each other
+        for i, j in self.find_bullet_pairs(alive, left, top, right, bottom):
+            if alive[i] and alive[j]:
+                alive[i] = alive[j] = False
+                self.emit_hit('bullet_hit', j, left, top)
+
+        # Check collisions of bullets with tanks, except own bullets
+        for tank in list(self.sim.tanks):
+            rect = tank.rect
+            hit = (alive & (left < rect.right) & (right > rect.left) &
+                   (top < rect.bottom) & (bottom > rect.top))
+            if tank in self.owner_index:
+                hit &= self.owner[:n] != self.owner_index[tank]
+            hit_indexes = numpy.flatnonzero(hit)
+            if len(hit_indexes):
+                # Tank is destroyed by leftmost bullet, like in sweep
+                i = hit_indexes[left[hit_indexes].argmin()]
+                alive[i] = False
+                tank.boom(self.owners[self.owner[i]])
+
+        # Compact arrays, live bullets are moved to start
+        keep = numpy.flatnonzero(alive)
+        count = len(keep)
+        for array in (self.pos, self.prev_pos, self.velocity, self.size,
+                      self.angle, self.owner, self.alive):
+            array[:count] = array[keep]
+        self.alive[count:n] = False
+        self.count = count
+
+    def find_bullet_pairs(self, alive, left, top, right, bottom):
+        # Function for getting pairs of colliding live bullets
+        # Bullets are sorted by left border and every bullet is compared
+        # with next bullets, which can overlap it by x
+        indexes = numpy.flatnonzero(alive)
+        if len(indexes) < 2:
+            return []
+        indexes = indexes[numpy.argsort(left[indexes], kind='stable')]
+        l, t, r, b = (left[indexes], top[indexes],
+                      right[indexes], bottom[indexes])
+
+        # Max distance in sorted order between overlapping bullets
+        window = int((numpy.searchsorted(l, r) -
+                      numpy.arange(len(l))).max())
+
+        pairs = []
+        for d in range(1, window):
+            overlap = ((l[d:] < r[:-d]) & (t[d:] < b[:-d]) &
+                       (t[:-d] < b[d:]))
+            for k in numpy.flatnonzero(overlap).tolist():
+                pairs.append((k + d, k))
+
+        # Pairs are ordered like in sweep of find_collision_pairs
+        pairs.sort()
+        return [(indexes[k], indexes[j]) for j, k in pairs]
+
+    def emit_hit(self, kind, i, left, top):
+        # Function for reporting about explosion at center of bullet
+        center = (int(left[i] + self.size[i, 0] // 2),
+                  int(top[i] + self.size[i, 1] // 2))
+        self.sim.emit(kind, center)
+
+    def draw_list(self, alpha=1):
+        # Function for getting (color, angle, position) of live bullets
+        # alpha parameter - part of step for interpolation of position
+        n = self.count
+        pos = self.prev_pos[:n] + (self.pos[:n] - self.prev_pos[:n]) * alpha
+        left, top = round_coordinates(pos).T
+        colors = [self.owners[i].color for i in self.owner[:n].tolist()]
+        return list(zip(colors, self.angle[:n].tolist(),
+                        zip(left.tolist(), top.tolist())))
+
+
+class Simulation:
+    # Game rules without display and audio
+    # Match is advanced frame by frame by step function
+    # with commands of players, identical seeds and commands
+    # give identical matches
+
+    def __init__(self, seed=None, level_names=None, bullet_arrays=False,
+                 profiler=None, players=2):
+        # players parameter - count of players, tanks are created
+        # on spawns with digits from 1 to players
+        # Seeded random for choosing levels
+        self.seed = seed
+        self.random = random.Random(seed)
+
+        # Profiler of frame phases(disabled if not given)
+        self.profiler = profiler if profiler is not None else FrameProfiler()
+
+        # Use NumPy bullet arrays instead of Bullet sprites
+        self.use_bullet_arrays = bullet_arrays
+
+        # Levels are sorted, because order of os.listdir isn't fixed
+        # Every level must have spawns for all players
+        self.level_names = sorted(level_names or get_level_list(players))
+        if not self.level_names:
+            raise ValueError(f'No levels have spawns for {players} players')
+        for name in self.level_names:
+            if name == GENERATED_LEVELS:
+                if players > LevelGenerator.SPAWNS:
+                    raise ValueError(f'Generated levels have '
+                                     f'{LevelGenerator.SPAWNS} spawns only')
+            elif not has_spawns(get_level_library().get(name), players):
+                raise ValueError(f'Level {name} has no spawns '
+                                 f'for {players} players')
+
+        # Player's scores
+        self.players = players
+        self.scores = [0] * players
+
+        # Tanks of players in round(None for players without spawn in level)
+        self.player_tanks = [None] * players
+
+        # Number of round and count of simulated frames
+        self.round = 0
+        self.frame = 0
+        self.round_frame = 0
+
+        # Events of current frame for display, audio and statistics
+        # Event format - (kind, *parameters)
+        self.events = []
+
+        self.new_round()
+
+    def emit(self, *event):
+        # Function for reporting about event of current frame
+        self.events.append(event)
+
+    def close(self):
+        # Function for releasing sprites of round
+        # Sprites refer to simulation, so links are broken explicitly
+        if self.round:
+            self.clear_bullets()
+            for group in (self.tanks, self.blocks, self.borders):
+                group.empty()
+            self.player_tanks = [None] * self.players
+            self.bullet_arrays = None
+
+    @property
+    def tank_1(self):
+        return self.player_tanks[0]
+
+    @property
+    def tank_2(self):
+        return self.player_tanks[1] if self.players > 1 else None
+
+    def new_round(self):
+        # Function of starting new round
+        self.close()
+        self.round += 1
+        self.round_frame = 0
+
+        # Get random level name and create sprites of level
+        level_name = self.random.choice(self.level_names)
+        if level_name == GENERATED_LEVELS:
+            # Generated level of round and next one, which is
+            # generated in background
+            level_name = self.get_generated_name(self.round)
+            get_level_library().prefetch(
+                self.get_generated_name(self.round + 1)
+            )
+        self.build_round(level_name)
+
+        self.emit('round_start', self.level_name)
+
+    def get_generated_name(self, round_number):
+        # Function for getting name of generated level of round
+        # Seed of level depends on seed of simulation and round
+        seed = zlib.crc32(f'{self.seed}:{round_number}'.encode())
+        return f'{GENERATED_PREFIX}{seed:08x}'
+
+    def clear_bullets(self):
+        # Function for removing all bullets to pool
+        for bullet in self.bullets:
+            bullet_pool.give(bullet)
+        self.bullets.empty()
+
+    def build_round(self, level_name):
+        # Function for creating sprites of level
+        self.level_name = level_name
+        self.level = level = get_level_library().get(self.level_name)
+
+        # Create empty lists of sprites
+        self.tanks = pygame.sprite.Group()
+        self.bullets = pygame.sprite.Group()
+        self.blocks = pygame.sprite.Group()
+
+        # Create borders around level
+        self.size = (level.cols * CELL_SIZE, level.rows * CELL_SIZE)
+        level_width, level_height = self.size
+        self.borders = pygame.sprite.Group()
+        Border(0, level_height, level_width, level_height, 1, self.borders)
+        Border(0, 0, level_width, 0, 0, self.borders)
+        Border(level_width, 0, level_width, level_height, 1, self.borders)
+        Border(0, 0, 0, level_height, 0, self.borders)
+
+        # Create grid index and blocks of level
+        self.grid = BlockGrid(level.cols, level.rows)
+        for (x, y), rect in zip(level.block_cells, level.block_rects):
+            self.grid.add(Block(rect, self.blocks), x, y)
+
+        # Create tanks on spawns(in order of cells in level)
+        for digit, (x, y) in sorted(level.spawns.items(),
+                                    key=lambda item: item[1][::-1]):
+            player = int(digit) - 1
+            if player < self.players:
+                self.player_tanks[player] = Tank(
+                    self,
+                    [12.5 + x * 75, 12.5 + y * 75],
+                    COLORS[player % len(COLORS)],
+                    player,
+                    self.tanks
+                )
 
-            # Play muted boom sound
-            BOOM_SOUND.set_volume(0.2)
-            BOOM_SOUND.play()
+        # Create bullet arrays for level
+        self.bullet_arrays = BulletArrays(self) if self.use_bullet_arrays \
+            else None
+
+    def snapshot(self):
+        # Function for saving state of simulation(for rollback)
+        # Blocks aren't saved, they are created again by level name
+        if self.bullet_arrays is not None:
+            raise ValueError("Snapshots of bullet arrays aren't supported")
+        tanks = self.player_tanks
+        return (
+            self.frame, self.round, self.round_frame, self.scores[:],
+            self.random.getstate(), self.level_name,
+            [(tank.pos[:], tank.prev_pos[:], tuple(tank.rect), tank.gun_angle,
+              tank.body_angle, tank.reload_frames, tank.not_moved_in_frame,
+              tank.destroyed, tank.new_round_countdown)
+             if tank is not None else None for tank in tanks],
+            [tanks.index(tank) for tank in self.tanks],
+            [(bullet.pos[:], bullet.prev_pos[:], tuple(bullet.rect),
+              bullet.v, bullet.vector, tanks.index(bullet.owner))
+             for bullet in self.bullets],
+        )
 
-            # Start explosion animation
-            Explosion(self.rect.center, 0.3)
+    def restore(self, state):
+        # Function for returning simulation to saved state
+        (self.frame, self.round, self.round_frame, scores, random_state,
+         level_name, tank_states, tank_order, bullet_states) = state
+        self.scores = scores[:]
+        self.random.setstate(random_state)
+
+        # Level is created again, if state is saved in round on other level
+        if level_name != self.level_name:
+            self.close()
+            self.build_round(level_name)
+
+        tanks = self.player_tanks
+        for tank, tank_state in zip(tanks, tank_states):
+            if tank is None:
+                continue
+            (pos, prev_pos, rect, tank.gun_angle, tank.body_angle,
+             tank.reload_frames, tank.not_moved_in_frame, tank.destroyed,
+             tank.new_round_countdown) = tank_state
+            tank.pos = pos[:]
+            tank.prev_pos = prev_pos[:]
+            tank.rect = pygame.Rect(rect)
+        self.tanks.empty()
+        self.tanks.add(*[tanks[i] for i in tank_order])
+
+        self.clear_bullets()
+        for pos, prev_pos, rect, v, vector, owner in bullet_states:
+            bullet = Bullet.spawn(self, pos[:], v, vector, tanks[owner].color,
+                                  tanks[owner])
+            bullet.prev_pos = prev_pos[:]
+            bullet.rect.update(rect)
+        self.events = []
+
+    def spawn_bullet(self, pos, v, vector, owner):
+        # Function for creating bullet fired by owner tank
+        if self.bullet_arrays is not None:
+            self.bullet_arrays.add(pos, v, vector, owner)
+        else:
+            Bullet.spawn(self, pos, v, vector, owner.color, owner)
+
+    def step(self, *masks):
+        # Function for simulating one step(1 / TICK_RATE seconds)
+        # masks parameter - masks of commands for tanks of players
+        # (missing masks are 0)
+        # Returns list of events of step
+        profiler = self.profiler
+        self.frame += 1
+        self.round_frame += 1
+
+        # Save coordinates of tanks for interpolation of drawing
+        for tank in self.tanks:
+            tank.prev_pos = tank.pos[:]
+
+        # Performing actions of players
+        for tank, mask in zip(self.player_tanks, masks):
+            if tank is not None:
+                tank.act(mask)
+        profiler.mark('input')
+
+        # Start new round, when only one tank is left
+        # and countdown of destroyed tank is over
+        if len(self.tanks) <= 1 and any(
+                tank.check_destroy() for tank in self.player_tanks
+                if tank is not None):
+            self.new_round()
+            profiler.mark('round')
+        else:
+            # Update sprites
+            self.tanks.update()
+            profiler.mark('tanks')
+            if self.bullet_arrays is not None:
+                self.bullet_arrays.update()
+                profiler.mark('bullets')
+            else:
+                self.bullets.update()
+                profiler.mark('bullets')
+                self.resolve_collisions()
+                profiler.mark('collisions')
+
+        events = self.events
+        self.events = []
+        return events
+
+    def resolve_collisions(self):
+        # Function for resolving bullets and tanks collisions once per frame
+        bullet_pairs, tank_pairs = find_collision_pairs(self.bullets,
+                                                        self.tanks)
+
+        for bullet_1, bullet_2 in bullet_pairs:
+            # Skip bullets, which already destroyed in this frame
+            if not (bullet_1.alive() and bullet_2.alive()):
+                continue
 
-    def destroy(self):
-        # Function of bullet destoroying
-        bullets.remove(self)
+            # Destroy bullets
+            bullet_1.destroy()
+            bullet_2.destroy()
+
+            # Report about explosion
+            self.emit('bullet_hit', bullet_2.rect.center)
+
+        for bullet, tank in tank_pairs:
+            if not bullet.alive() or tank.destroyed:
+                continue
 
-    def draw(self, screen):
-        # Function of bullet drawing
-        screen.blit(self.image, self.rect)
+            # If tank collides with bullet, start boom function
+            owner = bullet.owner
+            bullet.destroy()
+            tank.boom(owner)
 
 
 class Explosion(pygame.sprite.Sprite):
     # Explosion animation class
 
-    def __init__(self, center, size):
+    def __init__(self, center, size, *groups):
         # Explosion animation initialization
-        super(Explosion, self).__init__(booms)
+        super(Explosion, self).__init__()
+        self.reset(center, size, *groups)
 
-        # Create list of animation images with their editing with ratio "size"
-        self.explosion_anim = [pygame.transform.scale(load_image(f'explosion ({i + 1}).png', -1), (
-            list(map(lambda s: int(s * size),
-                     load_image(f'explosion ({i + 1}).png', -1).get_rect()[2:])))) for i in range(9)]
+    @classmethod
+    def spawn(cls, center, size, *groups):
+        # Function for creating explosion or taking free explosion from pool
+        boom = explosion_pool.take()
+        if boom is None:
+            return cls(center, size, *groups)
+        boom.reset(center, size, *groups)
+        return boom
+
+    def reset(self, center, size, *groups):
+        # Function for starting animation from first frame
+        self.add(*groups)
+
+        # Get shared list of animation images with ratio "size"
+        self.explosion_anim = assets.explosion(size)
 
         # Create image of animation and rectangle
         self.image = self.explosion_anim[0]
@@ -442,24 +1888,806 @@ class Explosion(pygame.sprite.Sprite):
 
                 # If current frame is last
                 if self.frame == len(self.explosion_anim):
-                    # Destroy animation
+                    # Destroy animation and return it to pool
                     self.killed = True
-                    booms.remove(self)
+                    self.kill()
+                    explosion_pool.give(self)
                 else:
                     # Draw next frame
                     center = self.rect.center
                     self.image = self.explosion_anim[self.frame]
-                    self.rect = self.image.get_rect()
+                    self.rect.size = self.image.get_size()
                     self.rect.center = center
 
+    def release(self):
+        # Function for breaking links of free explosion
+        self.image = None
+        self.explosion_anim = None
+
+
+class FramePacer:
+    # Waiting between frames and measuring of pacing
+    # Modes of waiting:
+    #   tick - clock.tick(sleep of system can be 1-2 ms longer)
+    #   busy - clock.tick_busy_loop(precise, but loads one core)
+    #   hybrid - sleeping till SPIN_TIME before deadline, then spinning
+    #   vsync - display update waits for vertical blank, input is sampled
+    #           as late as possible before it
+    # Input is sampled right after waiting, so measured latency is time
+    # from sampling of input to end of display update
+
+    MODES = ('tick', 'busy', 'hybrid', 'vsync')
+
+    # Time before deadline, which is spun instead of sleeping
+    SPIN_TIME = 0.002
+    # Reserve for work of frame(input, simulation and drawing) in vsync mode
+    WORK_MARGIN = 0.002
+    # Count of first frames in vsync mode, which measure refresh period
+    CALIBRATION_FRAMES = 30
+    # Measured refresh period is taken only between these parts of frame
+    # period(1 / fps), other values mean that display doesn't wait for
+    # vertical blank or misses blanks
+    MIN_REFRESH = 0.5
+    MAX_REFRESH = 2
+    # Max spread of middle half of frame times of calibration
+    # relative to refresh period
+    REFRESH_SPREAD = 0.1
+    # Frames of calibration are limited by this part of frame period,
+    # so display without vertical sync doesn't run unpaced
+    CALIBRATION_PERIOD = 1 / 3
+
+    # Count of frames in rolling windows of measuring and of work times
+    # for predicting of work in vsync mode
+    HISTORY = 600
+    WORK_HISTORY = 30
+
+    def __init__(self, mode='tick', fps=FPS):
+        self.mode = mode
+        self.fps = fps
+        self.period = 1 / fps
+
+        # Time of next sampling of input(hybrid mode), time of sampling
+        # of current frame and time of end of last display update
+        self.deadline = None
+        self.sample_time = None
+        self.flip_time = None
+
+        # Time of start of display update of current frame(None if
+        # it isn't reported)
+        self.present_time = None
+
+        # Times between display updates, from sampling to display update
+        # and from sampling to start of display update in seconds
+        # (waiting for blank isn't part of work)
+        self.frame_times = deque(maxlen=self.HISTORY)
+        self.latencies = deque(maxlen=self.HISTORY)
+        self.work_times = deque(maxlen=self.WORK_HISTORY)
+
+        # Refresh period of display in vsync mode(None until it's measured)
+        self.refresh = None
+
+    def wait(self, uncapped=False):
+        # Function of waiting for start of next frame
+        # uncapped parameter - don't wait at all
+        # Returns time since sampling of previous frame in seconds
+        if uncapped:
+            pass
+        elif self.mode == 'tick':
+            clock.tick(self.fps)
+        elif self.mode == 'busy':
+            clock.tick_busy_loop(self.fps)
+        elif self.mode == 'hybrid' or self.refresh == 0:
+            self.wait_deadline(self.period)
+        elif self.refresh is not None:
+            # Sample input so late, that frame is ready before next blank
+            work = max(self.work_times, default=0) + self.WORK_MARGIN
+            sleep_until(self.flip_time + self.refresh - work,
+                        self.SPIN_TIME)
+        else:
+            # Display update waits for blank during calibration
+            self.wait_deadline(self.period * self.CALIBRATION_PERIOD)
+
+        now = time.perf_counter()
+        frame_time = now - self.sample_time if self.sample_time else 0
+        self.sample_time = now
+        return frame_time
+
+    def wait_deadline(self, period):
+        # Function of waiting for deadline of frame
+        # Deadlines go by period, so late frame doesn't shift next ones,
+        # but after freeze deadlines start again from now
+        now = time.perf_counter()
+        if self.deadline is None or now - self.deadline > period:
+            self.deadline = now
+        sleep_until(self.deadline, self.SPIN_TIME)
+        self.deadline += period
+
+    def presenting(self):
+        # Function for saving time of start of display update
+        self.present_time = time.perf_counter()
+
+    def flipped(self):
+        # Function of measuring frame after display update
+        now = time.perf_counter()
+        if self.flip_time is not None:
+            self.frame_times.append(now - self.flip_time)
+        self.flip_time = now
+        if self.sample_time is not None:
+            self.latencies.append(now - self.sample_time)
+            if self.present_time is not None:
+                self.work_times.append(self.present_time - self.sample_time)
+        self.present_time = None
+
+        if self.mode == 'vsync' and self.refresh is None and \
+                len(self.frame_times) >= self.CALIBRATION_FRAMES:
+            # First frames are waited shorter than refresh, so display
+            # update waits for blank
+            # Without vertical sync frames are paced as in hybrid mode
+            # Frames, which wait for blank, have almost the same time
+            times = sorted(self.frame_times)
+            count = len(times)
+            refresh = times[count // 2]
+            steady = times[count * 3 // 4] - times[count // 4] < \
+                refresh * self.REFRESH_SPREAD
+            if steady and \
+                    self.MIN_REFRESH <= refresh / self.period <= \
+                    self.MAX_REFRESH:
+                self.refresh = refresh
+            else:
+                self.refresh = 0
+
+    def stats(self):
+        # Function for getting statistics of pacing in milliseconds
+        # Input latency is latency of sampled input plus mean waiting
+        # of input for sampling(half of frame)
+        frame_times = sorted(self.frame_times)
+        latencies = sorted(self.latencies)
+        if not frame_times or not latencies:
+            return None
+        count = len(frame_times)
+        mean = sum(frame_times) / count
+        jitter = (sum((value - mean) ** 2 for value in frame_times) /
+                  count) ** 0.5
+        latency = sum(latencies) / len(latencies)
+        return {
+            'frame_ms': mean * 1000,
+            'frame_jitter_ms': jitter * 1000,
+            'frame_p99_ms': frame_times[min(count - 1, count * 99 // 100)]
+            * 1000,
+            'latency_ms': latency * 1000,
+            'latency_p99_ms':
+                latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)]
+                * 1000,
+            'input_latency_ms': (latency + mean / 2) * 1000,
+        }
+
+    def describe(self):
+        # Function for getting line of statistics for overlay
+        stats = self.stats()
+        if stats is None:
+            return f'pacing {self.mode}'
+        return (f'pacing {self.mode}  frame ms {stats["frame_ms"]:.2f}'
+                f' +- {stats["frame_jitter_ms"]:.2f}'
+                f'  latency {stats["latency_ms"]:.2f}'
+                f'  input {stats["input_latency_ms"]:.2f}')
+
+
+def sleep_until(deadline, spin_time=0):
+    # Function of waiting till deadline(time of time.perf_counter)
+    # Last spin_time seconds are spun, because sleep can be longer
+    remaining = deadline - time.perf_counter() - spin_time
+    if remaining > 0:
+        time.sleep(remaining)
+    while time.perf_counter() < deadline:
+        pass
+
+
+class FrameProfiler:
+    # Profiler of time of frame phases
+    # Time between two marks is added to phase of second mark
+    # Disabled profiler returns from every function at once
+
+    PHASES = ['wait', 'events', 'input', 'round', 'tanks', 'bullets',
+              'collisions', 'explosions', 'draw', 'score', 'overlay',
+              'display', 'other']
+    COUNTS = ['tanks', 'bullets', 'booms', 'blocks', 'bullet_pool',
+              'boom_pool']
+
+    # Count of frames in rolling window of percentiles
+    HISTORY = 600
+    # Overlay is rendered again after this count of frames
+    OVERLAY_FRAMES = 15
+
+    def __init__(self, csv_path=None):
+        self.enabled = False
+        self.overlay = False
+
+        # Time of current frame by phases and time of last mark
+        self.phases = dict.fromkeys(self.PHASES, 0)
+        self.frame_start = 0
+        self.last = 0
+        self.frame = 0
+
+        # Frame times of rolling window and sums of phases for overlay
+        self.history = deque(maxlen=self.HISTORY)
+        self.window = dict.fromkeys(self.PHASES, 0)
+        self.window_frames = 0
+        self.counts = dict.fromkeys(self.COUNTS, 0)
+
+        self.font = None
+        self.overlay_image = None
+
+        # Pacer of frames, its statistics are shown in overlay
+        self.pacer = None
+
+        # Frames are streamed to CSV file, if it's given
+        self.csv_file = None
+        self.csv_writer = None
+        if csv_path is not None:
+            self.csv_file = open(csv_path, 'w', newline='')
+            self.csv_writer = csv.writer(self.csv_file)
+            self.csv_writer.writerow(
+                ['frame', 'frame_ms'] +
+                [phase + '_ms' for phase in self.PHASES] + self.COUNTS
+            )
+            self.enabled = True
+
+    def toggle_overlay(self):
+        # Function of showing and hiding overlay
+        self.overlay = not self.overlay
+        self.overlay_image = None
+        self.enabled = self.overlay or self.csv_writer is not None
+
+        # Frame, which is started before switching, isn't measured
+        self.frame_start = 0
+
+    def start_frame(self):
+        # Function of starting measuring of frame
+        if not self.enabled:
+            return
+        self.frame_start = self.last = time.perf_counter()
+        for phase in self.phases:
+            self.phases[phase] = 0
+
+    def mark(self, phase):
+        # Function of finishing phase of frame
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.phases[phase] += now - self.last
+        self.last = now
+
+    def end_frame(self, get_counts):
+        # Function of finishing measuring of frame
+        # get_counts parameter - function, which returns counts of sprites
+        if not self.enabled:
+            return
+        if not self.frame_start:
+            # Profiler was enabled in middle of frame
+            return
+        self.mark('other')
+        frame_time = self.last - self.frame_start
+        self.frame += 1
+        self.history.append(frame_time)
+        self.counts = get_counts()
+
+        for phase, value in self.phases.items():
+            self.window[phase] += value
+        self.window_frames += 1
+
+        if self.csv_writer is not None:
+            self.csv_writer.writerow(
+                [self.frame, round(frame_time * 1000, 3)] +
+                [round(self.phases[phase] * 1000, 3)
+                 for phase in self.PHASES] +
+                [self.counts.get(name, 0) for name in self.COUNTS]
+            )
+
+    def percentiles(self, *points):
+        # Function for getting percentiles of frame time in milliseconds
+        times = sorted(self.history)
+        if not times:
+            return [0] * len(points)
+        return [times[min(len(times) - 1, int(len(times) * point / 100))]
+                * 1000 for point in points]
+
+    def get_overlay(self):
+        # Function for getting image of overlay(None if it's hidden)
+        if not self.overlay:
+            return None
+        if self.overlay_image is not None and \
+                self.window_frames < self.OVERLAY_FRAMES:
+            return self.overlay_image
+
+        # Mean time of phases after last rendering of overlay
+        frames = max(self.window_frames, 1)
+        phases = [(phase, self.window[phase] / frames * 1000)
+                  for phase in self.PHASES if self.window[phase]]
+        self.window = dict.fromkeys(self.PHASES, 0)
+        self.window_frames = 0
+
+        p50, p95, p99 = self.percentiles(50, 95, 99)
+        lines = [f'frame ms  p50 {p50:.2f}  p95 {p95:.2f}  p99 {p99:.2f}']
+        for i in range(0, len(phases), 4):
+            lines.append('  '.join(f'{phase} {value:.2f}'
+                                   for phase, value in phases[i:i + 4]))
+        lines.append('  '.join(f'{name} {count}'
+                               for name, count in self.counts.items()))
+        if self.pacer is not None:
+            lines.append(self.pacer.describe())
+
+        # Render lines on one dark image
+        if self.font is None:
+            self.font = pygame.font.Font(None, 24)
+        images = [self.font.render(line, 1, pygame.Color('white'))
+                  for line in lines]
+        self.overlay_image = pygame.Surface(
+            (max(image.get_width() for image in images) + 10,
+             sum(image.get_height() for image in images) + 10)
+        )
+        y = 5
+        for image in images:
+            self.overlay_image.blit(image, (5, y))
+            y += image.get_height()
+        return self.overlay_image
+
+    def close(self):
+        # Function of closing CSV file
+        if self.csv_file is not None:
+            self.csv_file.close()
+            self.csv_file = None
+            self.csv_writer = None
+        self.enabled = self.overlay
+
+
+class Camera:
+    # Part of screen(viewport), which shows part of level around tank
+    # of player, level smaller than viewport is shown whole
+
+    def __init__(self, viewport, level_size, player=None):
+        # player parameter - index of followed player(None - camera
+        # doesn't move)
+        self.viewport = pygame.Rect(viewport)
+        self.level_size = level_size
+        self.player = player
+
+        # Visible part of level
+        self.view = pygame.Rect((0, 0), self.viewport.size)
+        self.look_at(level_size[0] / 2, level_size[1] / 2)
+
+        # Background of part of level around view and its rectangle in level
+        self.background = None
+        self.background_rect = None
+
+        # Rectangles, which were drawn in viewport in previous frame
+        self.dirty_rects = []
+
+    def look_at(self, x, y):
+        # Function for moving center of view to point, view doesn't leave
+        # level and level smaller than viewport is centered
+        # Returns True, if view was moved
+        topleft = []
+        for plane, point in enumerate((x, y)):
+            size = self.viewport.size[plane]
+            level_size = self.level_size[plane]
+            if level_size <= size:
+                topleft.append((level_size - size) // 2)
+            else:
+                topleft.append(min(max(int(point) - size // 2, 0),
+                                   level_size - size))
+        if tuple(topleft) == self.view.topleft:
+            return False
+        self.view.topleft = topleft
+        return True
+
+    def to_screen(self, rect):
+        # Function for moving rectangle from level to screen coordinates
+        return rect.move(self.viewport.x - self.view.x,
+                         self.viewport.y - self.view.y)
+
+    def shows_all(self):
+        # Function for checking if camera shows whole level without moving
+        # of coordinates(level fills screen)
+        return self.player is None and \
+            self.view.topleft == self.viewport.topleft and \
+            self.view.size == self.level_size
+
+    def to_background(self, rect):
+        # Function for moving rectangle from screen to background coordinates
+        return rect.move(
+            self.view.x - self.viewport.x - self.background_rect.x,
+            self.view.y - self.viewport.y - self.background_rect.y
+        )
+
 
-# Create borders
-borders = pygame.sprite.Group()
+class RoundRenderer:
+    # Renderer of round with static backgrounds and dirty rectangles
+    # Level is shown by cameras, if level is bigger than screen,
+    # screen is split between cameras of players
+    # Only blocks and sprites inside views of cameras are drawn
+
+    # Margin of background around view of moving camera,
+    # background is drawn again, when view leaves it
+    BACKGROUND_MARGIN = CELL_SIZE * 2
+
+    # Width of line between viewports of split screen
+    SPLIT_WIDTH = 4
+
+    # Max size of bullet's rectangle for culling of bullet arrays
+    BULLET_BOUNDS = (16, 16)
+
+    def __init__(self, surface, sim, players=(0, 1)):
+        # players parameter - indexes of players, which are followed
+        # by cameras
+        self.surface = surface
+        self.level = sim.level
+
+        # Whole level is shown by one camera, if it fits in screen
+        screen_rect = surface.get_rect()
+        if sim.size[0] <= screen_rect.w and sim.size[1] <= screen_rect.h:
+            self.cameras = [Camera(screen_rect, sim.size)]
+        else:
+            players = [player for player in players
+                       if player < sim.players] or [0]
+            width = (screen_rect.w - self.SPLIT_WIDTH * (len(players) - 1)) \
+                // len(players)
+            self.cameras = [
+                Camera((i * (width + self.SPLIT_WIDTH), 0, width,
+                        screen_rect.h), sim.size, player)
+                for i, player in enumerate(players)
+            ]
+        for camera in self.cameras:
+            self.follow(camera, sim, 1)
+            self.draw_background(camera)
+
+        # Score text is rendered only when score changes
+        self.font = pygame.font.Font(None, 60)
+        self.score = None
+        self.score_text = None
+        self.score_rect = None
+
+        # Rectangles of score and overlay, which were drawn in previous
+        # frame, and all rectangles, which were drawn in previous frame
+        self.top_rects = []
+        self.dirty_rects = []
+
+        # Sprites are drawn without culling and moving, if one camera
+        # shows whole level
+        self.fast = len(self.cameras) == 1 and self.cameras[0].shows_all()
+
+    def follow(self, camera, sim, alpha):
+        # Function for moving camera to tank of followed player
+        # Returns True, if view was moved
+        if camera.player is None:
+            return False
+        tank = sim.player_tanks[camera.player]
+        if tank is None:
+            return False
+        rect = interpolate_rect(tank.rect, tank.prev_pos, tank.pos, alpha)
+        return camera.look_at(*rect.center)
+
+    def draw_background(self, camera):
+        # Function for drawing background of part of level around view
+        # of camera, only blocks in this part are drawn
+        level = self.level
+        if camera.player is None:
+            rect = camera.view.copy()
+        else:
+            rect = camera.view.inflate(self.BACKGROUND_MARGIN * 2,
+                                       self.BACKGROUND_MARGIN * 2)
+        if camera.background is None or \
+                camera.background.get_size() != rect.size:
+            camera.background = pygame.Surface(rect.size).convert()
+        camera.background_rect = rect
+        background = camera.background
+
+        # Place out of level is filled by color of line between viewports
+        background.fill(pygame.Color('black'))
+        background.fill(BACKGROUND_COLOR, pygame.Rect(
+            -rect.x, -rect.y, level.cols * CELL_SIZE, level.rows * CELL_SIZE
+        ))
+
+        block_image = assets.image('block.png')
+        cols = range(max(rect.left // CELL_SIZE, 0),
+                     min(-(-rect.right // CELL_SIZE), level.cols))
+        rows = range(max(rect.top // CELL_SIZE, 0),
+                     min(-(-rect.bottom // CELL_SIZE), level.rows))
+        blocked = level.blocked
+        background.blits([
+            (block_image, (x * CELL_SIZE - rect.x, y * CELL_SIZE - rect.y))
+            for y in rows for x in cols if blocked[y * level.cols + x]
+        ], 0)
+
+    def draw_viewport(self, camera):
+        # Function for drawing background of whole viewport
+        self.surface.blit(camera.background, camera.viewport,
+                          camera.to_background(camera.viewport))
+
+    def draw_full(self):
+        # Function for drawing whole background(first frame of round)
+        self.surface.fill(pygame.Color('black'))
+        for camera in self.cameras:
+            self.draw_viewport(camera)
+        pygame.display.flip()
+
+    def is_visible(self, point, margin=CELL_SIZE):
+        # Function for checking if point of level is near view of any camera
+        return any(camera.view.inflate(margin * 2, margin * 2)
+                   .collidepoint(point) for camera in self.cameras)
+
+    def draw(self, sim, booms, alpha=1):
+        # Function for drawing frame and updating only changed regions
+        # alpha parameter - part of simulation step, which passed after
+        # last step, sprites are drawn between previous and last steps
+        profiler = sim.profiler
+        surface = self.surface
+
+        # Erase score and overlay of previous frame between viewports
+        if not self.fast:
+            for rect in self.top_rects:
+                surface.fill(pygame.Color('black'), rect)
+
+        # Move cameras and erase sprites of previous frame by background
+        # Viewport of moved camera is drawn whole
+        moved = []
+        if self.fast:
+            background = self.cameras[0].background
+            surface.blits([(background, rect, rect)
+                           for rect in self.cameras[0].dirty_rects +
+                           self.top_rects], 0)
+        else:
+            for camera in self.cameras:
+                if self.follow(camera, sim, alpha):
+                    if not camera.background_rect.contains(camera.view):
+                        self.draw_background(camera)
+                    self.draw_viewport(camera)
+                    moved.append(camera)
+                    continue
+                viewport = camera.viewport
+                surface.blits([
+                    (camera.background, rect, camera.to_background(rect))
+                    for rect in (viewport.clip(rect) for rect in
+                                 camera.dirty_rects + self.top_rects)
+                    if rect
+                ], 0)
+        profiler.mark('draw')
+
+        # Render score text if score changed
+        score = tuple(sim.scores)
+        if score != self.score:
+            self.score = score
+            self.score_text = self.font.render(
+                '    '.join(str(points) for points in score),
+                1,
+                pygame.Color('white')
+            )
+            self.score_rect = self.score_text.get_rect(
+                center=[surface.get_width() // 2, 30]
+            )
+        profiler.mark('score')
+
+        # Choose images of tanks from rotation tables
+        bodies = []
+        guns = []
+        for tank in sim.tanks:
+            rect = interpolate_rect(tank.rect, tank.prev_pos, tank.pos, alpha)
+            body, gun, gun_rect = tank_images(tank, rect)
+            bodies.append((body, rect))
+            guns.append((gun, gun_rect))
+
+        # Sprites of level in order of drawing, images of bullets
+        # are taken only for shown bullets
+        if sim.bullet_arrays is not None:
+            bullets = [((color, angle), pos) for color, angle, pos
+                       in sim.bullet_arrays.draw_list(alpha)]
+            if not self.fast:
+                bullets = [(key, pygame.Rect(pos, self.BULLET_BOUNDS))
+                           for key, pos in bullets]
+
+            def bullet_image_of(key):
+                return assets.rotated(f'bullet_{key[0]}.png', key[1], -1)
+        else:
+            bullets = [
+                (bullet, interpolate_rect(bullet.rect, bullet.prev_pos,
+                                          bullet.pos, alpha))
+                for bullet in sim.bullets
+            ]
+            bullet_image_of = bullet_image
+        sprites = bodies
+        sprites.extend((boom.image, boom.rect) for boom in booms)
+        sprites.extend(guns)
+
+        # Draw sprites inside views of cameras by one batch for camera
+        rects = []
+        for camera in self.cameras:
+            if self.fast:
+                shown_bullets = bullets
+                shown_sprites = sprites
+            else:
+                view = camera.view
+                shown_bullets = [(key, camera.to_screen(rect))
+                                 for key, rect in bullets
+                                 if view.colliderect(rect)]
+                shown_sprites = [(image, camera.to_screen(rect))
+                                 for image, rect in sprites
+                                 if view.colliderect(rect)]
+            sequence = [(bullet_image_of(key), pos)
+                        for key, pos in shown_bullets]
+            sequence.extend(shown_sprites)
+            surface.set_clip(camera.viewport)
+            camera.dirty_rects = surface.blits(sequence)
+            if camera in moved:
+                rects.append(camera.viewport)
+            else:
+                rects.extend(camera.dirty_rects)
+        surface.set_clip(None)
+
+        # Draw score above viewports
+        self.top_rects = [surface.blit(self.score_text, self.score_rect)]
+        profiler.mark('draw')
+
+        # Draw profiler overlay above all sprites
+        overlay = profiler.get_overlay()
+        if overlay is not None:
+            self.top_rects.append(surface.blit(overlay, (10, 10)))
+        rects.extend(self.top_rects)
+        profiler.mark('overlay')
+
+        # Update regions of previous and current frames
+        if profiler.pacer is not None:
+            profiler.pacer.presenting()
+        pygame.display.update(self.dirty_rects + rects)
+        self.dirty_rects = rects
+        profiler.mark('display')
+
+
+class AudioPlayer:
+    # Music and sound effects of game
+    # Music is streamed by pygame.mixer.music, effects are played
+    # on reserved channels with own volume of every play
+    # Player does nothing until init function is called
+
+    def __init__(self):
+        self.sounds = {}
+        self.channels = []
+
+        # Volume of current play on every channel
+        self.volumes = []
+
+        # Time and volume of last play of every effect
+        self.last_plays = {}
+
+        self.music_loaded = False
+
+    def init(self, channels=EFFECT_CHANNELS):
+        # Function for reserving channels and loading effects
+        # Game works without sound, if there is no audio device
+        if not pygame.mixer.get_init():
+            return
+        pygame.mixer.set_num_channels(max(pygame.mixer.get_num_channels(),
+                                          channels))
+        pygame.mixer.set_reserved(channels)
+        self.channels = [pygame.mixer.Channel(i) for i in range(channels)]
+        self.volumes = [0] * channels
+        for name, path in SOUND_FILES.items():
+            self.sounds[name] = pygame.mixer.Sound(path)
+
+    def play(self, name, volume=1):
+        # Function of playing effect with volume
+        if not self.channels:
+            return
+
+        # Too frequent plays of one effect aren't heard, so they are skipped
+        now = pygame.time.get_ticks()
+        last_time, last_volume = self.last_plays.get(name, (None, 0))
+        if last_time is not None and now - last_time < EFFECT_INTERVAL \
+                and volume <= last_volume:
+            return
+
+        # Take free channel or channel with the quietest play
+        index = None
+        for i, channel in enumerate(self.channels):
+            if not channel.get_busy():
+                index = i
+                break
+        if index is None:
+            index = min(range(len(self.channels)),
+                        key=self.volumes.__getitem__)
+            if self.volumes[index] > volume:
+                return
+
+        channel = self.channels[index]
+        channel.set_volume(volume)
+        channel.play(self.sounds[name])
+        self.volumes[index] = volume
+        self.last_plays[name] = (now, volume)
+
+    def play_music(self):
+        # Function of playing music in loop
+        # Music file is opened at first play, game works without it
+        if not pygame.mixer.get_init():
+            return
+        if not self.music_loaded:
+            try:
+                pygame.mixer.music.load(MUSIC_FILE)
+            except (pygame.error, FileNotFoundError):
+                return
+            self.music_loaded = True
+        pygame.mixer.music.play(-1)
+
+    def stop_music(self):
+        # Function of stopping music
+        if self.music_loaded:
+            pygame.mixer.music.stop()
+
+
+# Music and sound effects of game
+audio = AudioPlayer()
+
+
+# Function for getting rectangle between previous and current coordinates
+def interpolate_rect(rect, prev_pos, pos, alpha):
+    rect = rect.copy()
+    rect.x = prev_pos[0] + (pos[0] - prev_pos[0]) * alpha
+    rect.y = prev_pos[1] + (pos[1] - prev_pos[1]) * alpha
+    return rect
+
+
+# Function for getting tank's images from rotation tables by angles
+# rect parameter - rectangle of tank's body for drawing
+# Returns body image, gun image and gun rectangle
+def tank_images(tank, rect):
+    body_frames = assets.rotations(f'tank_body_{tank.color}.png', BODY_FRAMES)
+    gun_frames = assets.rotations(f'tank_barrel_{tank.color}.png',
+                                  GUN_FRAMES, 0)
+
+    body_index = round((tank.body_angle + 90) * BODY_FRAMES / 360)
+    body = body_frames[body_index % BODY_FRAMES][0]
+
+    gun_index = round(tank.gun_angle * GUN_FRAMES / 360)
+    gun, gun_offset = gun_frames[gun_index % GUN_FRAMES]
+
+    return body, gun, gun_offset.move(rect.center)
+
+
+# Function for getting bullet's image rotated by bullet's angle
+def bullet_image(bullet):
+    return assets.rotated(f'bullet_{bullet.color}.png', bullet.angle, -1)
+
+
+# Explosion size and boom sound volume for hit events
+HIT_EFFECTS = {
+    'block_hit': (0.2, 0.1),
+    'bullet_hit': (0.3, 0.2),
+    'tank_hit': (1, 1),
+}
+
+
+def play_events(events, booms, is_visible=None):
+    # Function for playing sounds and explosions of simulation events
+    # is_visible parameter - function for checking if point of level
+    # is shown, explosions are started only in shown places
+    for event in events:
+        if event[0] in HIT_EFFECTS:
+            size, volume = HIT_EFFECTS[event[0]]
+
+            # Play boom sound
+            audio.play('boom', volume)
+
+            # Start explosion animation
+            if is_visible is None or is_visible(event[1]):
+                Explosion.spawn(event[1], size, booms)
+        elif event[0] == 'shot':
+            # Play shot sound
+            audio.play('shot')
+
+
+def clear_booms(booms):
+    # Function for removing all explosions of group to pool
+    for boom in booms:
+        explosion_pool.give(boom)
+    booms.empty()
 
-Border(0, height, width, height, 1)
-Border(0, 0, width, 0, 0)
-Border(width, 0, width, height, 1)
-Border(0, 0, 0, height, 0)
 
 # Dicts with settings of keyboards for players
 PLAYER_1_KEYS = {
@@ -487,6 +2715,714 @@ REMOVE_COMMANDS = [
     'fire/',
 ]
 
+# List of all tank's commands
+TANK_COMMANDS = list(PLAYER_1_KEYS.values())
+
+# Bits of commands in command masks
+# Tank does only first move in step, so mask has one move at most,
+# commands of mask are done in order of TANK_COMMANDS
+COMMAND_BITS = {command: 1 << i for i, command in enumerate(TANK_COMMANDS)}
+MOVE_COMMANDS = [command for command in TANK_COMMANDS
+                 if command.startswith('move/')]
+MOVE_MASK = sum(COMMAND_BITS[command] for command in MOVE_COMMANDS)
+REMOVE_MASK = sum(COMMAND_BITS[command] for command in REMOVE_COMMANDS)
+
+# Directions of move by bits
+MOVE_DIRECTIONS = {COMMAND_BITS[command]: command.split('/')[1]
+                   for command in MOVE_COMMANDS}
+# Bits of moves by bits of opposite moves
+OPPOSITE_MOVES = {
+    COMMAND_BITS['move/up']: COMMAND_BITS['move/down'],
+    COMMAND_BITS['move/down']: COMMAND_BITS['move/up'],
+    COMMAND_BITS['move/left']: COMMAND_BITS['move/right'],
+    COMMAND_BITS['move/right']: COMMAND_BITS['move/left'],
+}
+# Bits of vertical moves
+VERTICAL_MOVES = (COMMAND_BITS['move/up'], COMMAND_BITS['move/down'])
+# Bits of dodging moves across line to enemy
+# (by flag if line is rather vertical)
+DODGE_MOVES = {
+    False: VERTICAL_MOVES,
+    True: (COMMAND_BITS['move/left'], COMMAND_BITS['move/right']),
+}
+ROTATE_RIGHT_BIT = COMMAND_BITS['rotate_gun/true']
+ROTATE_LEFT_BIT = COMMAND_BITS['rotate_gun/false']
+FIRE_BIT = COMMAND_BITS['fire/']
+
+
+def command_mask(commands):
+    # Function for converting list of commands to mask
+    mask = 0
+    moved = False
+    for command in commands:
+        if command in MOVE_COMMANDS:
+            # Only first move is done by tank
+            if moved:
+                continue
+            moved = True
+        mask |= COMMAND_BITS[command]
+    return mask
+
+
+class Controller:
+    # Source of commands of one tank
+    # update function gets events and key states of frame,
+    # get_mask function returns mask of commands of next step
+
+    def update(self, events, pressed):
+        pass
+
+    def get_mask(self):
+        return 0
+
+
+class KeyboardController(Controller):
+    # Controller by keys of player
+    # Held keys are taken from key states, keys of commands,
+    # which are done once(fire), are taken from key pushing events
+
+    def __init__(self, keys):
+        # keys parameter - dict of commands by keys
+        # Keys of moves in order of priority, last pushed move is first
+        self.move_keys = [(key, COMMAND_BITS[command])
+                          for key, command in keys.items()
+                          if command in MOVE_COMMANDS]
+        # Keys of other held commands
+        self.hold_keys = [(key, COMMAND_BITS[command])
+                          for key, command in keys.items()
+                          if command not in MOVE_COMMANDS and
+                          command not in REMOVE_COMMANDS]
+        # Bits of commands, which are done once by pushing
+        self.push_keys = {key: COMMAND_BITS[command]
+                          for key, command in keys.items()
+                          if command in REMOVE_COMMANDS}
+
+        # Key states of frame and pushed commands, which aren't done yet
+        self.pressed = None
+        self.pushed = 0
+
+    def update(self, events, pressed):
+        for event in events:
+            if event.type == pygame.KEYDOWN:
+                if event.key in self.push_keys:
+                    self.pushed |= self.push_keys[event.key]
+                else:
+                    # Move by last pushed key has priority
+                    for i, (key, bit) in enumerate(self.move_keys):
+                        if key == event.key:
+                            self.move_keys.insert(0, self.move_keys.pop(i))
+                            break
+        self.pressed = pressed
+
+    def get_mask(self):
+        mask = self.pushed
+        self.pushed = 0
+        pressed = self.pressed
+        if pressed is None:
+            return mask
+        for key, bit in self.move_keys:
+            if pressed[key]:
+                mask |= bit
+                break
+        for key, bit in self.hold_keys:
+            if pressed[key]:
+                mask |= bit
+        return mask
+
+
+class RandomPlayer(Controller):
+    # Player, which holds random keys, for headless matches
+
+    def __init__(self, seed=None, hold_frames=15):
+        self.random = random.Random(seed)
+
+        # Count of frames, while keys are held
+        self.hold_frames = hold_frames
+        self.frame = 0
+        self.mask = 0
+
+    def get_mask(self):
+        # Function for getting mask of current frame
+        if self.frame % self.hold_frames == 0:
+            self.mask = command_mask(self.random.sample(TANK_COMMANDS, 2))
+        self.frame += 1
+        return self.mask
+
+
+class BotController(Controller):
+    # Bot, which drives tank of simulation
+    # Bot goes to nearest enemy by flow field of level, turns gun to enemy
+    # and fires, when enemy is in line of sight
+    # While enemy is in line of sight, bot moves aside to avoid its bullets
+
+    def __init__(self, sim, player, seed=None):
+        # player parameter - index of player of tank
+        self.sim = sim
+        self.player = player
+        self.random = random.Random(seed)
+
+        # Level and its navigation tables
+        self.level = None
+        self.navigation = None
+
+        # Move bit of dodging from enemy's bullets
+        self.dodge = 0
+
+        # Max deviation of center from cell's center on moving across
+        self.align = None
+
+    def get_mask(self):
+        sim = self.sim
+        if sim.level is not self.level:
+            self.level = sim.level
+            self.navigation = get_navigation(sim.level)
+        tank = sim.player_tanks[self.player]
+        if tank is None or tank.destroyed:
+            return 0
+        if self.align is None:
+            self.align = tank.speed * TICK / 2
+        x, y = tank.pos[0] + TANK_SIZE / 2, tank.pos[1] + TANK_SIZE / 2
+
+        # Find nearest enemy(destroyed tanks aren't in group of tanks)
+        enemy, enemy_distance = None, math.inf
+        for other in sim.tanks:
+            if other is not tank:
+                distance = (other.pos[0] - tank.pos[0]) ** 2 + \
+                    (other.pos[1] - tank.pos[1]) ** 2
+                if distance < enemy_distance:
+                    enemy, enemy_distance = other, distance
+        if enemy is None:
+            return 0
+
+        navigation = self.navigation
+        enemy_x = enemy.pos[0] + TANK_SIZE / 2
+        enemy_y = enemy.pos[1] + TANK_SIZE / 2
+        cell = navigation.cell_at(x, y)
+        target = navigation.cell_at(enemy_x, enemy_y)
+        if cell is None or target is None:
+            return 0
+
+        # Aim to place, where enemy will be at bullet's arrival
+        # (enemy's speed is taken from its last step), if this place
+        # is in line of sight, else aim to enemy
+        flight = hypotenuse(enemy_x - x, enemy_y - y) / tank.bullet_speed
+        aim_x = enemy_x + (enemy.pos[0] - enemy.prev_pos[0]) * TICK_RATE * flight
+        aim_y = enemy_y + (enemy.pos[1] - enemy.prev_pos[1]) * TICK_RATE * flight
+        aim = navigation.cell_at(aim_x, aim_y)
+        if aim is None or not navigation.is_visible(cell, aim):
+            aim_x, aim_y = enemy_x, enemy_y
+
+        # Turn gun to aim by shortest way
+        # (gun with angle 0 fires up, angle grows counterclockwise)
+        mask = 0
+        angle = math.degrees(math.atan2(x - aim_x, y - aim_y))
+        turn = (angle - tank.gun_angle + 180) % 360 - 180
+        rotate_step = tank.rotate_speed * TICK
+        if turn > rotate_step / 2:
+            mask |= ROTATE_RIGHT_BIT
+        elif turn < -rotate_step / 2:
+            mask |= ROTATE_LEFT_BIT
+
+        if navigation.is_visible(cell, target):
+            ready = tank.reload_frames == 0 and abs(turn) <= rotate_step
+
+            # Move across line to enemy, so bullets of tanks
+            # don't meet each other, side is changed after every shot
+            # and when tank is stopped by block
+            if not self.dodge or ready:
+                self.dodge = self.random.choice(
+                    DODGE_MOVES[abs(x - enemy_x) < abs(y - enemy_y)]
+                )
+                if ready:
+                    mask |= FIRE_BIT
+            elif tank.pos == tank.prev_pos:
+                self.dodge = OPPOSITE_MOVES[self.dodge]
+            return mask | self.dodge
+        self.dodge = 0
+
+        move = navigation.flow(target)[cell]
+        if not move:
+            return mask
+        # Tank is aligned to center of cell before moving across,
+        # so it doesn't stop at corners of blocks
+        cell_x = (cell % navigation.cols + 0.5) * CELL_SIZE
+        cell_y = (cell // navigation.cols + 0.5) * CELL_SIZE
+        if move in VERTICAL_MOVES:
+            if x - cell_x > self.align:
+                move = COMMAND_BITS['move/left']
+            elif cell_x - x > self.align:
+                move = COMMAND_BITS['move/right']
+        else:
+            if y - cell_y > self.align:
+                move = COMMAND_BITS['move/up']
+            elif cell_y - y > self.align:
+                move = COMMAND_BITS['move/down']
+        return mask | move
+
+
+class ReplayController(Controller):
+    # Controller, which repeats commands of tank from replay
+    # get_mask returns None after end of replay
+
+    def __init__(self, replay, tank):
+        # tank parameter - index of tank(0 or 1)
+        self.masks = (masks[tank] for masks in replay.masks())
+
+    def get_mask(self):
+        return next(self.masks, None)
+
+
+class Replay:
+    # Input log of match: seed, levels and command masks of tanks
+    # in every step, masks are stored with run-length encoding
+    # Simulation with the same seed, levels and commands
+    # repeats match exactly
+
+    MAGIC = b'STRP'
+    VERSION = 2
+
+    def __init__(self, seed, level_names, checksums=None, tick_rate=TICK_RATE,
+                 players=2):
+        self.seed = seed
+        self.players = players
+        self.level_names = sorted(level_names)
+        self.tick_rate = tick_rate
+
+        # Checksums of levels for detecting changed levels
+        if checksums is None:
+            library = get_level_library()
+            checksums = [library.checksum(name) for name in self.level_names]
+        self.checksums = checksums
+
+        # Runs of steps with the same commands - [masks of players, steps]
+        self.runs = []
+        self.steps = 0
+
+    def record(self, *masks):
+        # Function for adding step to log
+        if self.runs and self.runs[-1][0] == masks:
+            self.runs[-1][1] += 1
+        else:
+            self.runs.append([masks, 1])
+        self.steps += 1
+
+    def masks(self):
+        # Function for getting masks of tanks in every step
+        for masks, steps in self.runs:
+            for _ in range(steps):
+                yield masks
+
+    def check_levels(self):
+        # Function for checking that levels weren't changed after recording
+        library = get_level_library()
+        for name, checksum in zip(self.level_names, self.checksums):
+            if library.checksum(name) != checksum:
+                raise ValueError(f'Level {name} was changed after recording')
+
+    def pack(self):
+        # Function for packing log to bytes
+        data = bytearray(self.MAGIC)
+        data += struct.pack('<BQHHB', self.VERSION, self.seed, self.tick_rate,
+                            len(self.level_names), self.players)
+        for name, checksum in zip(self.level_names, self.checksums):
+            name = name.encode()
+            data += struct.pack('<B', len(name)) + name
+            data += struct.pack('<I', checksum)
+        data += struct.pack('<I', self.steps)
+
+        # Count of steps of run is written by 7 bits in byte
+        runs = bytearray()
+        for masks, steps in self.runs:
+            runs += bytes(masks)
+            while steps >= 0x80:
+                runs.append(steps & 0x7f | 0x80)
+                steps >>= 7
+            runs.append(steps)
+        return bytes(data + zlib.compress(bytes(runs), 9))
+
+    @classmethod
+    def unpack(cls, data):
+        # Function for unpacking log from bytes
+        if data[:4] != cls.MAGIC:
+            raise ValueError('File is not replay of SquareTanks')
+        # Replays of version 1 don't contain count of players(always 2)
+        version = data[4]
+        if version not in (1, cls.VERSION):
+            raise ValueError(f'Unsupported replay version {version}')
+        header = '<BQHH' if version == 1 else '<BQHHB'
+        version, seed, tick_rate, levels_count, *players = struct.unpack_from(
+            header, data, 4
+        )
+        players = players[0] if players else 2
+        if tick_rate != TICK_RATE:
+            raise ValueError(f'Replay is recorded with tick rate {tick_rate}')
+        offset = 4 + struct.calcsize(header)
+
+        level_names = []
+        checksums = []
+        for _ in range(levels_count):
+            length = data[offset]
+            level_names.append(data[offset + 1:offset + 1 + length].decode())
+            offset += 1 + length
+            checksums.append(struct.unpack_from('<I', data, offset)[0])
+            offset += 4
+        steps, = struct.unpack_from('<I', data, offset)
+        offset += 4
+
+        replay = cls(seed, level_names, checksums, tick_rate, players)
+        runs = zlib.decompress(data[offset:])
+        i = 0
+        while i < len(runs):
+            masks = tuple(runs[i:i + players])
+            i += players
+            count = 0
+            shift = 0
+            while runs[i] & 0x80:
+                count |= (runs[i] & 0x7f) << shift
+                shift += 7
+                i += 1
+            count |= runs[i] << shift
+            i += 1
+            replay.runs.append([masks, count])
+        replay.steps = sum(run[1] for run in replay.runs)
+        if replay.steps != steps:
+            raise ValueError('Replay is damaged')
+        return replay
+
+    def save(self, path):
+        # Function for saving log to file
+        with open(path, 'wb') as file:
+            file.write(self.pack())
+
+    @classmethod
+    def load(cls, path):
+        # Function for loading log from file
+        with open(path, 'rb') as file:
+            return cls.unpack(file.read())
+
+
+def play_replay(replay, bullet_arrays=False):
+    # Function of playing replay without display at full speed
+    # Returns simulation after last step
+    replay.check_levels()
+    sim = Simulation(replay.seed, replay.level_names,
+                     bullet_arrays=bullet_arrays, players=replay.players)
+    for masks in replay.masks():
+        sim.step(*masks)
+    return sim
+
+
+class RoundTelemetry:
+    # Statistics of rounds of match, which are collected from events
+    # of simulation, finished rounds are given to telemetry writer
+    # Round is measured till it's decided(one tank or none is left),
+    # countdown before next round isn't counted, because last round
+    # of match has no countdown
+
+    def __init__(self, sim, writer):
+        self.sim = sim
+        self.writer = writer
+        self.start_round()
+
+    def start_round(self):
+        # Function of starting statistics of new round
+        sim = self.sim
+        self.round = sim.round
+        self.level_name = sim.level_name
+        self.start_frame = sim.frame
+        self.shots = [0] * sim.players
+        self.bullet_hits = 0
+        self.block_hits = 0
+
+        # Steps of first destroying of tank and of deciding of round
+        # after start of round and player, who is left in round
+        # (-1 if nobody)
+        self.kill_frame = None
+        self.end_frame = None
+        self.winner = -1
+
+    def observe(self, events):
+        # Function for counting events of step
+        for event in events:
+            kind = event[0]
+            if kind == 'round_start':
+                self.finish()
+                self.start_round()
+            elif self.end_frame is not None:
+                # Round is decided already
+                continue
+            elif kind == 'shot':
+                self.shots[event[1].player] += 1
+            elif kind == 'block_hit':
+                self.block_hits += 1
+            elif kind == 'bullet_hit':
+                self.bullet_hits += 1
+            elif kind == 'tank_hit':
+                if self.kill_frame is None:
+                    self.kill_frame = self.sim.frame - self.start_frame
+                if len(self.sim.tanks) <= 1:
+                    self.end_frame = self.sim.frame - self.start_frame
+                    self.winner = next(iter(self.sim.tanks)).player \
+                        if self.sim.tanks else -1
+
+    def finish(self):
+        # Function for giving statistics of round to writer
+        # Rounds, which are left before they are decided, aren't saved
+        if self.end_frame is None:
+            return
+        self.writer.put((
+            time.time(), self.sim.seed or 0, self.round, self.level_name,
+            self.end_frame, self.kill_frame,
+            self.shots, self.bullet_hits, self.block_hits, self.winner
+        ))
+
+
+class TelemetryWriter:
+    # Writer of round statistics to append-only file on background thread
+    # Game only adds records to queue, records are packed and written
+    # by batches, so slow disk never stops frames
+    # Every batch has own header, so batches of several processes
+    # can be appended to one file
+
+    MAGIC = b'STTM'
+    VERSION = 1
+    # Batch header - magic, version, tick rate, count of records
+    # and length of compressed records
+    BATCH_HEADER = '<4sBHHI'
+    # Record - time, seed, round, steps of round, steps to kill,
+    # bullet hits, block hits, winner and count of players
+    # Record is followed by shots of players and level name
+    RECORD = '<dQHIIHIbB'
+
+    # Count of records, which wakes writer, and max time of records in queue
+    BATCH_SIZE = 64
+    FLUSH_INTERVAL = 2
+    # Records over this count are dropped, if writer can't keep up
+    MAX_PENDING = 10000
+
+    def __init__(self, path):
+        self.path = path
+
+        # Records, which aren't written yet, and count of dropped records
+        self.pending = deque()
+        self.dropped = 0
+
+        # Last error of writing(writing errors don't stop game)
+        self.error = None
+
+        self.wake = threading.Event()
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name='telemetry',
+                                       daemon=True)
+        self.thread.start()
+
+    def put(self, record):
+        # Function for adding record to queue, it never waits for disk
+        if len(self.pending) >= self.MAX_PENDING:
+            self.dropped += 1
+            return
+        self.pending.append(record)
+        if len(self.pending) >= self.BATCH_SIZE:
+            self.wake.set()
+
+    def run(self):
+        # Cycle of writer thread
+        while True:
+            self.wake.wait(self.FLUSH_INTERVAL)
+            self.wake.clear()
+            closed = self.closed
+            self.flush()
+            if closed:
+                return
+
+    def flush(self):
+        # Function for writing all records of queue by one batch
+        records = []
+        while self.pending:
+            records.append(self.pending.popleft())
+        if not records:
+            return
+        data = bytearray()
+        for (seconds, seed, round_number, level_name, steps, kill_steps,
+             shots, bullet_hits, block_hits, winner) in records:
+            data += struct.pack(self.RECORD, seconds, seed & (1 << 64) - 1,
+                                round_number & 0xffff, steps, kill_steps,
+                                min(bullet_hits, 0xffff), block_hits, winner,
+                                len(shots))
+            data += struct.pack(f'<{len(shots)}H',
+                                *[min(count, 0xffff) for count in shots])
+            name = level_name.encode()
+            data += struct.pack('<B', len(name)) + name
+        data = zlib.compress(bytes(data))
+        batch = struct.pack(self.BATCH_HEADER, self.MAGIC, self.VERSION,
+                            TICK_RATE, len(records), len(data)) + data
+        try:
+            # Batch is written by one call, so it isn't mixed with batches
+            # of other processes
+            with open(self.path, 'ab') as file:
+                file.write(batch)
+        except OSError as error:
+            self.error = error
+            self.dropped += len(records)
+
+    def close(self):
+        # Function of writing left records and stopping writer thread
+        self.closed = True
+        self.wake.set()
+        self.thread.join()
+
+    @classmethod
+    def read(cls, path):
+        # Function for reading records of telemetry file
+        # Yields dicts of rounds, damaged end of file(after crash) is ignored
+        with open(path, 'rb') as file:
+            data = file.read()
+        header_size = struct.calcsize(cls.BATCH_HEADER)
+        record_size = struct.calcsize(cls.RECORD)
+        offset = 0
+        while offset + header_size <= len(data):
+            magic, version, tick_rate, count, length = struct.unpack_from(
+                cls.BATCH_HEADER, data, offset
+            )
+            if magic != cls.MAGIC:
+                raise ValueError('File is not telemetry of SquareTanks')
+            if version != cls.VERSION:
+                raise ValueError(f'Unsupported telemetry version {version}')
+            offset += header_size
+            if offset + length > len(data):
+                return
+            records = zlib.decompress(data[offset:offset + length])
+            offset += length
+
+            i = 0
+            for _ in range(count):
+                (seconds, seed, round_number, steps, kill_steps, bullet_hits,
+                 block_hits, winner, players) = struct.unpack_from(
+                    cls.RECORD, records, i
+                )
+                i += record_size
+                shots = list(struct.unpack_from(f'<{players}H', records, i))
+                i += players * 2
+                name_length = records[i]
+                level_name = records[i + 1:i + 1 + name_length].decode()
+                i += 1 + name_length
+                yield {
+                    'time': seconds,
+                    'seed': seed,
+                    'round': round_number,
+                    'level': level_name,
+                    'duration': steps / tick_rate,
+                    'time_to_kill': kill_steps / tick_rate,
+                    'shots': shots,
+                    'bullet_hits': bullet_hits,
+                    'block_hits': block_hits,
+                    'winner': winner,
+                }
+
+
+# Times of startup stages in seconds after start of loading of game
+startup_times = {}
+
+
+def mark_startup(stage):
+    # Function for saving time of first reaching of startup stage
+    startup_times.setdefault(stage, time.perf_counter() - START_TIME)
+
+
+class Preloader:
+    # Loading of sounds, images and levels on background thread,
+    # while start screen is shown
+
+    def __init__(self):
+        self.thread = None
+        self.error = None
+
+    def start(self):
+        # Function of starting loading
+        self.thread = threading.Thread(target=self.load, name='preload',
+                                       daemon=True)
+        self.thread.start()
+
+    def load(self):
+        try:
+            # Load sound effects(music is streamed, when it plays)
+            audio.init()
+
+            # Load images
+            assets.preload()
+
+            # Compile levels
+            get_level_library(LEVEL_CACHE_FILE)
+        except Exception as error:
+            self.error = error
+        mark_startup('preload')
+
+    def wait(self):
+        # Function for waiting of end of loading
+        # Error of loading is raised in main thread
+        if self.thread is not None:
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+preloader = Preloader()
+
+
+def setup_headless():
+    # Function for preparing scripts of game's folder to run without
+    # window and sound card
+    # Must be called before initialization of display and mixer
+    # Returns folder, which was current before, paths of script's
+    # arguments are relative to it
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    start_dir = os.getcwd()
+    os.chdir(GAME_DIR)
+    return start_dir
+
+
+def init_subsystems():
+    # Function of initialization of used pygame subsystems only
+    # (pygame.init starts all subsystems, including joysticks)
+    pygame.display.init()
+    pygame.font.init()
+
+    # SDL timer, which is needed by pygame.time.get_ticks,
+    # is started by first waiting
+    pygame.time.wait(0)
+
+    try:
+        pygame.mixer.init()
+    except pygame.error:
+        # Game works without sound, if there is no audio device
+        pass
+
+
+def init_game(vsync=False):
+    # Function of display initialization
+    # Sounds, images and levels are loaded on background thread
+    # vsync parameter - display update waits for vertical blank(if driver
+    # can't do it, display is created without vertical sync)
+    # Returns True, if display has vertical sync
+    global screen
+
+    init_subsystems()
+
+    screen = None
+    if vsync:
+        try:
+            screen = pygame.display.set_mode(SCREEN_SIZE, pygame.SCALED,
+                                             vsync=1)
+        except pygame.error:
+            vsync = False
+    if screen is None:
+        screen = pygame.display.set_mode(SCREEN_SIZE)
+    mark_startup('display')
+
+    preloader.start()
+    return vsync
+
 
 def terminate():
     # Function of game closing
@@ -494,162 +3430,309 @@ def terminate():
     sys.exit()
 
 
-def new_match():
-    # Function of starting new match
+class Game:
+    # Game with explicit states, which are switched by one main cycle
+    # Menu visits and rounds don't call each other, so objects
+    # of previous match and round are released
 
-    RELOAD_SOUND.play()
+    # States of game
+    MENU = 'menu'
+    PLAYING = 'playing'
+    PAUSED = 'paused'
+    ROUND_OVER = 'round_over'
 
-    # Zeroing of player's counts
-    global player_1_score, player_2_score
-    player_1_score = 0
-    player_2_score = 0
-    new_round()
+    def __init__(self, profiler=None, record_dir=None, bot=False, players=2,
+                 level_names=None, pacer=None, telemetry=None):
+        self.state = None
 
+        # Writer of statistics of rounds(statistics aren't saved if None)
+        self.telemetry_writer = telemetry
 
-def new_round():
-    # Function of starting new round
-    global all_sprites, obstacles, booms, tanks, bullets, blocks
+        # Levels of matches(all levels if None)
+        self.level_names = level_names
 
-    # Variable for check if now is pause
-    pause = False
+        # Second tank is driven by bot, if bot is True
+        self.bot = bot
 
-    # Get random level name
-    level_name = random.choice(get_level_list())
+        # Count of players, tanks of players after second are driven by bots
+        self.players = players
 
-    # Create empty lists of sprites
-    all_sprites = pygame.sprite.Group()
-    obstacles = pygame.sprite.Group()
-    booms = pygame.sprite.Group()
-    tanks = pygame.sprite.Group()
-    bullets = pygame.sprite.Group()
-    blocks = pygame.sprite.Group()
+        # Players, which are followed by cameras on big levels
+        self.focus = (0, 1)
 
-    # Load levels
-    level = load_level(level_name)
+        # Folder for replays of matches(matches aren't recorded if None)
+        self.record_dir = record_dir
 
-    # Load blocks by level scheme
-    for y in range(-1, len(level)):
-        line = level[y]
-        for x in range(len(line)):
-            if line[x] == '*':
-                Block([x, y], blocks, all_sprites, obstacles)
-            elif line[x] == '1':
-                tank_1 = Tank(
-                    [12.5 + x * 75, 12.5 + y * 75],
-                    COLORS[0],
-                    2,
-                    tanks,
-                    obstacles,
-                    all_sprites
-                )
-            elif line[x] == '2':
-                tank_2 = Tank(
-                    [12.5 + x * 75, 12.5 + y * 75],
-                    COLORS[1],
-                    1,
-                    tanks,
-                    obstacles,
-                    all_sprites
-                )
+        # Profiler of frame phases(disabled if not given)
+        self.profiler = profiler if profiler is not None else FrameProfiler()
+
+        # Waiting between frames
+        self.pacer = pacer if pacer is not None else FramePacer()
+        self.profiler.pacer = self.pacer
+
+        # Objects of match, they exist only while match is played
+        self.sim = None
+        self.renderer = None
+        self.round_number = None
+        self.booms = pygame.sprite.Group()
+
+        # Controllers of tanks
+        self.controllers = []
 
-    # Create list for pushed buttons
-    button_lst = []
+        # Time, which isn't simulated yet
+        self.accumulator = 0
 
-    # Main cycle of game
-    while True:
-        # Fill screen by bright-blue color
-        screen.fill((125, 200, 255))
+        # State, which is restored after pause
+        self.resume_state = None
 
-        keyup_lst = []
+        # Log of recorded match and statistics of its rounds
+        self.recording = None
+        self.telemetry = None
 
-        # Get events
-        events = pygame.event.get()
+        # Replay is played without waiting of clock, if uncapped is True
+        self.uncapped = False
+
+    def run(self, replay=None, uncapped=False):
+        # Main cycle of game
+        # replay parameter - replay, which is played instead of start screen
+        profiler = self.profiler
+        if replay is None:
+            self.open_menu()
+        else:
+            self.start_replay(replay, uncapped)
+        pacer = self.pacer
+        pacer.wait(True)
+        try:
+            while True:
+                # Wait for frame and get its time
+                # Input is sampled right after waiting
+                profiler.start_frame()
+                frame_time = min(pacer.wait(self.uncapped), MAX_FRAME_TIME)
+                profiler.mark('wait')
+
+                # Get events
+                events = pygame.event.get()
+                for event in events:
+                    if event.type == pygame.QUIT:
+                        # Close game
+                        terminate()
+                    elif event.type == pygame.KEYDOWN and \
+                            event.key == PROFILER_KEY:
+                        # Show or hide profiler overlay
+                        profiler.toggle_overlay()
+                events = [event for event in events
+                          if event.type != pygame.KEYDOWN or
+                          event.key != PROFILER_KEY]
+                profiler.mark('events')
+
+                if self.state == self.MENU:
+                    self.update_menu(events)
+                else:
+                    self.update_match(events, frame_time)
+                pacer.flipped()
+                profiler.end_frame(self.get_counts)
+        finally:
+            self.close_match()
+            profiler.close()
+
+    def get_counts(self):
+        # Function for getting counts of sprites for profiler
+        # Pools are shown by high-water marks
+        sim = self.sim
+        counts = {'booms': len(self.booms),
+                  'bullet_pool': bullet_pool.high_water,
+                  'boom_pool': explosion_pool.high_water}
+        if sim is None:
+            return counts
+        if sim.bullet_arrays is not None:
+            bullets = sim.bullet_arrays.count
+        else:
+            bullets = len(sim.bullets)
+        counts.update(tanks=len(sim.tanks), bullets=bullets,
+                      blocks=len(sim.blocks))
+        return counts
+
+    def open_menu(self):
+        # Function of switching to start screen
+        self.close_match()
+        self.state = self.MENU
+
+        # Play start screen music
+        audio.play_music()
+
+        draw_start_screen()
+        pygame.display.flip()
+        mark_startup('first_frame')
+
+    def update_menu(self, events):
+        # Function of start screen frame
         for event in events:
-            if event.type == pygame.QUIT:
-                # Close game
-                terminate()
             if event.type == pygame.KEYDOWN:
-                # Add buttons to pushed buttons list
-                button_lst.append(event.key)
-            if event.type == pygame.KEYUP:
-                if event.key in button_lst:
-                    # Delete button from pushed buttons list
-                    button_lst.remove(event.key)
+                if event.key == pygame.K_ESCAPE:
+                    # Close game
+                    terminate()
                 else:
-                    # Add pushed button to delete list
-                    keyup_lst.append(event.key)
-
-        # Delete buttons from pushed button list by delete list
-        for key in keyup_lst:
-            if key in button_lst:
-                button_lst.remove(key)
+                    # Stop music
+                    audio.stop_music()
+                    # Start new match
+                    self.start_match()
+                    return
 
-        # Check pause
-        if not pause:
-
-            # Performing actions by pushed buttons list
-            for i in button_lst[::-1]:
-                if i in PLAYER_1_KEYS.keys():
-                    command = PLAYER_1_KEYS[i]
-                    tank_1.action(command)
-                    if command in REMOVE_COMMANDS:
-                        button_lst.remove(i)
-                elif i in PLAYER_2_KEYS.keys():
-                    command = PLAYER_2_KEYS[i]
-                    tank_2.action(command)
-                    if command in REMOVE_COMMANDS:
-                        button_lst.remove(i)
-                elif i == pygame.K_ESCAPE:
-                    button_lst.remove(i)
-                    start_screen()
-                elif i == pygame.K_p:
-                    pause = not pause
-                    button_lst.remove(i)
-
-            # Start function for new round if one of tanks is destroyed
-            tank_1.check_destroy()
-            tank_2.check_destroy()
+        pygame.display.flip()
 
-            # Update sprites
-            tanks.update()
-            bullets.update()
-            booms.update()
+    def start_match(self):
+        # Function of starting new match
+        preloader.wait()
+        audio.play('reload')
+
+        # Start match with zero player's counts
+        # Seed is chosen here, so match can be recorded
+        self.sim = Simulation(random.getrandbits(64), self.level_names,
+                              profiler=self.profiler, players=self.players)
+        if self.record_dir is not None:
+            self.recording = Replay(self.sim.seed, self.sim.level_names,
+                                    players=self.players)
+        if self.telemetry_writer is not None:
+            self.telemetry = RoundTelemetry(self.sim, self.telemetry_writer)
+        self.controllers = [KeyboardController(PLAYER_1_KEYS)]
+        if self.bot:
+            self.focus = (0,)
         else:
-            # If pause, check P button is pressed to start game
-            for i in button_lst:
-                if i == pygame.K_p:
-                    pause = not pause
-                    button_lst.remove(i)
-
-        # Sprites drawing
-        blocks.draw(screen)
-        for i in bullets.sprites():
-            i.draw(screen)
-        for i in tanks.sprites():
-            i.draw_body(screen)
-        booms.draw(screen)
-        for i in tanks.sprites():
-            i.draw_gun(screen)
-
-        # Create and draw text of score
-        font = pygame.font.Font(None, 60)
-        players_count_text = font.render(
-            str(player_1_score) + '    ' + str(player_2_score),
-            1,
-            pygame.Color('white')
-        )
-        text_rect = players_count_text.get_rect(center=[SCREEN_SIZE[0] // 2, 30])
-        screen.blit(players_count_text, text_rect)
+            self.focus = (0, 1)
+            self.controllers.append(KeyboardController(PLAYER_2_KEYS))
+        while len(self.controllers) < self.players:
+            self.controllers.append(BotController(
+                self.sim, len(self.controllers),
+                self.sim.seed + len(self.controllers)
+            ))
+        self.accumulator = 0
+        self.start_round()
+
+    def start_replay(self, replay, uncapped=False):
+        # Function of starting playing of recorded match
+        # uncapped parameter - play one step in every frame without waiting
+        preloader.wait()
+        replay.check_levels()
+        self.sim = Simulation(replay.seed, replay.level_names,
+                              profiler=self.profiler, players=replay.players)
+        self.controllers = [ReplayController(replay, player)
+                            for player in range(replay.players)]
+        self.focus = (0, 1)
+        self.uncapped = uncapped
+        self.accumulator = 0
+        self.start_round()
+
+    def start_round(self):
+        # Function for drawing background of new round
+        self.round_number = self.sim.round
+        clear_booms(self.booms)
+        self.renderer = RoundRenderer(screen, self.sim, self.focus)
+        self.renderer.draw_full()
+        self.profiler.mark('draw')
+        self.state = self.PLAYING
+
+    def close_match(self):
+        # Function for releasing objects of match
+        if self.recording is not None and self.recording.steps:
+            os.makedirs(self.record_dir, exist_ok=True)
+            self.recording.save(os.path.join(
+                self.record_dir,
+                time.strftime('%Y%m%d-%H%M%S-') +
+                f'{self.recording.seed:016x}.replay'
+            ))
+        self.recording = None
+        if self.telemetry is not None:
+            self.telemetry.finish()
+        self.telemetry = None
+        self.uncapped = False
+        if self.sim is not None:
+            self.sim.close()
+        self.sim = None
+        self.renderer = None
+        self.round_number = None
+        clear_booms(self.booms)
+        self.controllers = []
+
+    def toggle_pause(self):
+        # Function of switching pause
+        if self.state == self.PAUSED:
+            self.state = self.resume_state
+        else:
+            self.resume_state = self.state
+            self.state = self.PAUSED
 
-        clock.tick(FPS)
-        pygame.display.flip()
+    def update_match(self, events, frame_time):
+        # Function of match frame
+        for event in events:
+            if event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_ESCAPE:
+                    # Return to start screen
+                    self.open_menu()
+                    return
+                elif event.key == pygame.K_p:
+                    self.toggle_pause()
 
+        # Key states are taken once in frame for all controllers
+        # Keys aren't taken in pause, so fire isn't done after pause
+        if self.state != self.PAUSED:
+            pressed = pygame.key.get_pressed()
+            for controller in self.controllers:
+                controller.update(events, pressed)
 
-def start_screen():
-    # Function of start screen
+        self.profiler.mark('input')
 
-    # Play start screen music
-    MUSIC.play(-1)
+        # Check pause
+        if self.state != self.PAUSED:
+            self.simulate(frame_time)
+
+        # Sprites and score drawing
+        if self.state != self.MENU:
+            self.renderer.draw(self.sim, self.booms,
+                               1 if self.uncapped else self.accumulator / TICK)
+
+    def simulate(self, frame_time):
+        # Function for simulating steps, which passed in frame
+        if self.uncapped:
+            # Uncapped replay simulates one step in every frame
+            self.accumulator = TICK
+        else:
+            self.accumulator += frame_time
+        steps = int(self.accumulator / TICK)
+        if not steps:
+            return
+
+        # Simulate passed steps and play their sounds and explosions
+        for _ in range(steps):
+            # Take commands of step from controllers
+            masks = [controller.get_mask() for controller in self.controllers]
+            if None in masks:
+                # Replay is over
+                self.open_menu()
+                return
+            if self.recording is not None:
+                self.recording.record(*masks)
+
+            events = self.sim.step(*masks)
+            if self.telemetry is not None:
+                self.telemetry.observe(events)
+            play_events(events, self.booms, self.renderer.is_visible)
+            self.profiler.mark('explosions')
+            self.accumulator -= TICK
+
+            # Round is over, when only one tank is left
+            if len(self.sim.tanks) <= 1 and \
+                    any(event[0] == 'tank_hit' for event in events):
+                self.state = self.ROUND_OVER
+        self.booms.update()
+        self.profiler.mark('explosions')
+
+        # Start drawing of new round
+        if self.sim.round != self.round_number:
+            self.start_round()
+
+
+def draw_start_screen():
+    # Function of start screen drawing
 
     # Text, which drawing in start screen
     intro_text = ["SquareTanks",
@@ -672,7 +3755,7 @@ def start_screen():
                   ]
 
     # Draw text
-    fon = pygame.transform.scale(load_image('fon.png'), SCREEN_SIZE)
+    fon = assets.scaled('fon.png', SCREEN_SIZE)
     screen.blit(fon, (0, 0))
     font = pygame.font.Font(None, 30)
     text_coord = 0
@@ -685,26 +3768,83 @@ def start_screen():
         text_coord += intro_rect.height
         screen.blit(string_rendered, intro_rect)
 
-    # Start screen cycle
-    while True:
-        # Get events
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                # Close game
-                terminate()
-            elif event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_ESCAPE:
-                    # Close game
-                    terminate()
-                else:
-                    # Stop music
-                    MUSIC.stop()
-                    # Start new match
-                    new_match()
 
-        clock.tick(FPS)
-        pygame.display.flip()
+mark_startup('import')
 
 
 if __name__ == '__main__':
-    start_screen()
+    import argparse
+
+    parser = argparse.ArgumentParser(description='SquareTanks')
+    parser.add_argument('--profile-csv',
+                        help='file for streaming frame profile in CSV')
+    parser.add_argument('--record', metavar='DIR',
+                        help='folder for saving replays of matches')
+    parser.add_argument('--replay', metavar='FILE', help='play replay file')
+    parser.add_argument('--uncapped', action='store_true',
+                        help='play replay without waiting between frames')
+    parser.add_argument('--bot', action='store_true',
+                        help='second tank is driven by bot')
+    parser.add_argument('--players', type=int, default=2,
+                        choices=range(2, 10), metavar='N',
+                        help='count of tanks(2-9), tanks after second '
+                             'are driven by bots, only levels with spawns '
+                             'for all tanks are played')
+    parser.add_argument('--pacing', choices=FramePacer.MODES,
+                        default='tick',
+                        help='waiting between frames: tick(default), '
+                             'busy(precise, loads core), hybrid(sleep and '
+                             'spin), vsync(late input before vertical blank)')
+    parser.add_argument('--pacing-stats', action='store_true',
+                        help='print frame times and input latency at exit')
+    parser.add_argument('--telemetry', metavar='FILE',
+                        help='file for appending statistics of rounds')
+    parser.add_argument('--generated', action='store_true',
+                        help='play on generated levels')
+    parser.add_argument('--headless', action='store_true',
+                        help='play replay without display and print result')
+    parser.add_argument('--measure-startup', action='store_true',
+                        help='show start screen, wait for loading, '
+                             'print times of startup and exit')
+    args = parser.parse_args()
+    if args.generated and args.players > LevelGenerator.SPAWNS:
+        parser.error(f'generated levels have {LevelGenerator.SPAWNS} '
+                     f'spawns only')
+    if not args.generated and not get_level_list(args.players):
+        parser.error(f'no levels have spawns for {args.players} players')
+
+    if args.measure_startup:
+        init_game()
+        Game().open_menu()
+        preloader.wait()
+        for stage, seconds in sorted(startup_times.items(),
+                                     key=lambda item: item[1]):
+            print(f'{stage:<12}{seconds * 1000:>9.1f} ms')
+        terminate()
+
+    replay = Replay.load(args.replay) if args.replay else None
+    if replay is not None and args.headless:
+        start = time.perf_counter()
+        sim = play_replay(replay)
+        seconds = time.perf_counter() - start
+        print(f'seed {replay.seed:016x}  rounds {sim.round}  '
+              f'score {":".join(map(str, sim.scores))}  steps {sim.frame}  '
+              f'{sim.frame / seconds:.0f} steps/s')
+        sim.close()
+        sys.exit()
+
+    pacing = args.pacing
+    if not init_game(pacing == 'vsync') and pacing == 'vsync':
+        print('Vertical sync is not available, hybrid pacing is used')
+        pacing = 'hybrid'
+    pacer = FramePacer(pacing)
+    telemetry = TelemetryWriter(args.telemetry) if args.telemetry else None
+    try:
+        Game(FrameProfiler(args.profile_csv), args.record, args.bot,
+             args.players, [GENERATED_LEVELS] if args.generated else None,
+             pacer, telemetry).run(replay, args.uncapped)
+    finally:
+        if telemetry is not None:
+            telemetry.close()
+        if args.pacing_stats:
+            print(pacer.describe())
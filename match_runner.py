@@ -0,0 +1,264 @@
+# Headless match runner
+# Plays many matches between random players or bots on a process pool
+# and reports results and speed
+#
+# Example:
+#     python match_runner.py --matches 200 --workers 4
+#     python match_runner.py --matches 64 --scaling --json results.json
+#     python match_runner.py --matches 50 --players bot random
+#     python match_runner.py --levels level_8.txt --players bot bot bot bot
+#     python match_runner.py --levels generated --players bot bot
+#     python match_runner.py --matches 50 --telemetry rounds.stm
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import main
+
+START_DIR = main.setup_headless()
+
+
+# Kinds of players of headless matches
+PLAYERS = ('random', 'bot')
+
+
+def make_player(kind, sim, tank, seed):
+    # Function for creating player of tank by kind
+    if kind == 'bot':
+        return main.BotController(sim, tank, seed)
+    return main.RandomPlayer(seed)
+
+
+def play_match(seed, level_name, score_limit=3, max_frames=main.TICK_RATE * 300,
+               bullet_arrays=False, players=('random', 'random'),
+               telemetry=None):
+    # Function of playing one headless match
+    # Match ends when one of players gets score_limit points
+    # or after max_frames frames
+    # players parameter - kinds of players of tanks
+    # telemetry parameter - file for appending statistics of rounds
+    sim = main.Simulation(seed, [level_name], bullet_arrays=bullet_arrays,
+                          players=len(players))
+    players = [make_player(kind, sim, i, seed * len(players) + i)
+               for i, kind in enumerate(players)]
+    writer = None
+    if telemetry is not None:
+        writer = main.TelemetryWriter(telemetry)
+        rounds = main.RoundTelemetry(sim, writer)
+
+    shots = [0] * len(players)
+    hits = {'block_hit': 0, 'bullet_hit': 0, 'tank_hit': 0}
+    round_lengths = []
+    round_start_frame = 0
+
+    while sim.frame < max_frames and max(sim.scores) < score_limit:
+        events = sim.step(*[player.get_mask() for player in players])
+        if writer is not None:
+            rounds.observe(events)
+
+        for event in events:
+            if event[0] == 'shot':
+                shots[event[1].player] += 1
+            elif event[0] in hits:
+                hits[event[0]] += 1
+                if event[0] == 'tank_hit' and len(sim.tanks) <= 1:
+                    # Time to kill of round
+                    round_lengths.append(
+                        (sim.frame - round_start_frame) / main.TICK_RATE
+                    )
+            elif event[0] == 'round_start':
+                round_start_frame = sim.frame
+
+    if writer is not None:
+        rounds.finish()
+        writer.close()
+    # Bullets of last round are returned to pool
+    sim.close()
+
+    # Winner is number of player with max score(0 for draw)
+    best = max(sim.scores)
+    winner = sim.scores.index(best) + 1 if sim.scores.count(best) == 1 else 0
+
+    return {
+        'seed': seed,
+        'level': level_name,
+        'winner': winner,
+        'scores': sim.scores,
+        'frames': sim.frame,
+        'timed_out': max(sim.scores) < score_limit,
+        'round_lengths': round_lengths,
+        'shots': shots,
+        'hits': hits,
+    }
+
+
+def play_matches(tasks, workers, **options):
+    # Function of playing matches on process pool
+    # tasks parameter - list of (seed, level name)
+    # Returns list of results and time of playing in seconds
+    start = time.perf_counter()
+    if workers == 1:
+        results = [play_match(seed, level, **options) for seed, level in tasks]
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            futures = [executor.submit(play_match, seed, level, **options)
+                       for seed, level in tasks]
+            results = [future.result() for future in futures]
+    return results, time.perf_counter() - start
+
+
+def make_tasks(matches, levels, seed):
+    # Function for assignment of levels and seeds to matches
+    # Levels are assigned by turns, every match has own seed
+    return [(seed + i, levels[i % len(levels)]) for i in range(matches)]
+
+
+def summarize(results):
+    # Function for collecting statistics of matches by levels
+    levels = {}
+    for result in results:
+        level = levels.setdefault(result['level'], {
+            'matches': 0,
+            'wins': [0] * (len(result['scores']) + 1),
+            'timed_out': 0,
+            'round_lengths': [],
+            'shots': 0,
+            'hits': {'block_hit': 0, 'bullet_hit': 0, 'tank_hit': 0},
+        })
+        level['matches'] += 1
+        level['wins'][result['winner']] += 1
+        level['timed_out'] += result['timed_out']
+        level['round_lengths'] += result['round_lengths']
+        level['shots'] += sum(result['shots'])
+        for kind, count in result['hits'].items():
+            level['hits'][kind] += count
+
+    for level in levels.values():
+        lengths = level.pop('round_lengths')
+        level['rounds'] = len(lengths)
+        level['mean_round_length'] = sum(lengths) / len(lengths) \
+            if lengths else None
+    return levels
+
+
+def print_summary(summary):
+    # Function for printing table of statistics by levels
+    players = max(len(level['wins']) for level in summary.values()) - 1
+    print(f'{"level":<14}{"matches":>8}'
+          + ''.join(f'{f"p{i + 1} wins":>8}' for i in range(players)) +
+          f'{"draws":>7}{"rounds":>7}{"round s":>9}{"shots":>8}'
+          f'{"blocks":>8}{"bullets":>8}')
+    for name in sorted(summary):
+        level = summary[name]
+        length = level['mean_round_length']
+        print(f'{name:<14}{level["matches"]:>8}'
+              + ''.join(f'{wins:>8}' for wins in level['wins'][1:]) +
+              f'{level["wins"][0]:>7}{level["rounds"]:>7}'
+              f'{"-" if length is None else f"{length:.1f}":>9}'
+              f'{level["shots"]:>8}{level["hits"]["block_hit"]:>8}'
+              f'{level["hits"]["bullet_hit"]:>8}')
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Play headless SquareTanks matches on a process pool.'
+    )
+    parser.add_argument('--matches', type=int, default=100,
+                        help='count of matches')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='count of worker processes')
+    parser.add_argument('--levels', nargs='*',
+                        help='level files or "generated" for generated '
+                             'levels(all levels with spawns for all '
+                             'players by default)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of first match')
+    parser.add_argument('--score-limit', type=int, default=3,
+                        help='points to win match')
+    parser.add_argument('--max-seconds', type=float, default=300,
+                        help='max game time of match')
+    parser.add_argument('--bullet-arrays', action='store_true',
+                        help='use NumPy bullet arrays')
+    parser.add_argument('--players', nargs='+', choices=PLAYERS,
+                        default=['random', 'random'],
+                        help='kinds of players of tanks(2 or more)')
+    parser.add_argument('--scaling', action='store_true',
+                        help='measure speed for 1, 2, 4, ... workers')
+    parser.add_argument('--json', help='file for results in JSON')
+    parser.add_argument('--telemetry',
+                        help='file for appending statistics of rounds')
+    args = parser.parse_args(argv)
+    if len(args.players) < 2:
+        parser.error('at least 2 players are needed')
+    if args.levels and main.GENERATED_LEVELS in args.levels and \
+            len(args.players) > main.LevelGenerator.SPAWNS:
+        parser.error(f'generated levels have '
+                     f'{main.LevelGenerator.SPAWNS} spawns only')
+    library = main.get_level_library()
+    for name in args.levels or []:
+        if name != main.GENERATED_LEVELS and \
+                not main.has_spawns(library.get(name), len(args.players)):
+            parser.error(f'level {name} has no spawns for '
+                         f'{len(args.players)} players')
+
+    levels = args.levels or sorted(main.get_level_list(len(args.players)))
+    tasks = make_tasks(args.matches, levels, args.seed)
+    options = {
+        'score_limit': args.score_limit,
+        'max_frames': int(args.max_seconds * main.TICK_RATE),
+        'bullet_arrays': args.bullet_arrays,
+        'players': tuple(args.players),
+        'telemetry': os.path.join(START_DIR, args.telemetry)
+        if args.telemetry else None,
+    }
+
+    # Counts of workers for measuring
+    if args.scaling:
+        worker_counts = []
+        count = 1
+        while count < args.workers:
+            worker_counts.append(count)
+            count *= 2
+        worker_counts.append(args.workers)
+    else:
+        worker_counts = [args.workers]
+
+    speed = []
+    for workers in worker_counts:
+        results, seconds = play_matches(tasks, workers, **options)
+        # Statistics of rounds are saved once for all measurements
+        options['telemetry'] = None
+        rate = len(results) / seconds
+        speed.append({
+            'workers': workers,
+            'seconds': seconds,
+            'matches_per_second': rate,
+            'matches_per_second_per_core': rate / workers,
+        })
+
+    summary = summarize(results)
+    print_summary(summary)
+    print()
+
+    base_rate = speed[0]['matches_per_second'] / speed[0]['workers']
+    print(f'{"workers":>8}{"seconds":>10}{"matches/s":>11}'
+          f'{"per core":>10}{"scaling":>9}')
+    for item in speed:
+        scaling = item['matches_per_second'] / base_rate / item['workers']
+        print(f'{item["workers"]:>8}{item["seconds"]:>10.2f}'
+              f'{item["matches_per_second"]:>11.2f}'
+              f'{item["matches_per_second_per_core"]:>10.2f}'
+              f'{scaling:>9.0%}')
+
+    if args.json:
+        with open(os.path.join(START_DIR, args.json), 'w') as file:
+            json.dump({'speed': speed, 'levels': summary,
+                       'matches': results}, file, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
@@ -0,0 +1,548 @@
+# Networked mode for two players
+# Both players run the same simulation, only command masks of tanks
+# are sent over UDP. Local commands are done after few frames(input delay),
+# remote commands, which haven't come yet, are predicted, and when they
+# come and differ from prediction, simulation is rolled back to frame
+# of commands and simulated again up to current frame.
+# Every packet carries all commands, which aren't acknowledged yet,
+# so lost packets are covered by next ones.
+#
+# Example:
+#     python netplay.py host --port 7777
+#     python netplay.py join 127.0.0.1:7777 --latency 40 --jitter 10
+#     python netplay.py loopback --latency 60 --jitter 20 --loss 0.1
+
+import argparse
+import asyncio
+import os
+import random
+import struct
+import sys
+import time
+
+import pygame
+
+import main
+
+# Levels and images are loaded by paths relative to game's folder
+os.chdir(main.GAME_DIR)
+
+# Frames between sampling of local commands and their doing
+INPUT_DELAY = 2
+# Max count of frames, which can be simulated again
+MAX_ROLLBACK = 8
+# Max count of commands in one packet
+MAX_BATCH = 64
+
+# Packets: magic, type and data of type
+MAGIC = b'ST'
+HELLO = 0
+START = 1
+INPUT = 2
+PROTOCOL_VERSION = 1
+
+# Input packet: ack, first frame, frame of sender, send time, echo time
+# and count of masks, then masks by one byte
+INPUT_HEADER = '<2sBIIIddH'
+
+
+class RollbackSession:
+    # Simulation with command masks of local and remote tanks by frames
+    # Frame numbers start from 0, frame f is simulated by step
+    # with masks of frame f
+
+    def __init__(self, sim, local, input_delay=INPUT_DELAY,
+                 max_rollback=MAX_ROLLBACK):
+        self.sim = sim
+
+        # Index of local tank(0 - tank_1, 1 - tank_2)
+        self.local = local
+        self.remote = 1 - local
+        self.input_delay = input_delay
+        self.max_rollback = max_rollback
+
+        # Masks of tanks by frames, first frames have no commands
+        self.inputs = [dict.fromkeys(range(input_delay), 0)
+                       for _ in range(2)]
+        # Predicted masks of remote tank, which are used in simulation
+        self.predicted = {}
+        # States of simulation before frames
+        self.snapshots = {}
+
+        # Next frame for simulation
+        self.frame = 0
+        # First frame, for which remote mask hasn't come
+        self.confirmed = input_delay
+        # First frame of local masks, which remote player hasn't got
+        self.acked = 0
+        # First frame, which was simulated with wrong prediction
+        self.rollback_frame = None
+
+        # Statistics
+        self.rollbacks = 0
+        self.resimulated = 0
+        self.max_depth = 0
+
+    def add_local_input(self, mask):
+        # Function for adding local mask, returns frame of mask
+        frame = self.frame + self.input_delay
+        self.inputs[self.local][frame] = mask
+        return frame
+
+    def add_remote_input(self, frame, mask):
+        # Function for adding remote mask
+        # Returns True if mask is new
+        remote = self.inputs[self.remote]
+        if frame < self.confirmed or frame in remote:
+            return False
+        remote[frame] = mask
+
+        # Wrong prediction of simulated frame needs rollback
+        predicted = self.predicted.pop(frame, None)
+        if predicted is not None and predicted != mask and \
+                (self.rollback_frame is None or frame < self.rollback_frame):
+            self.rollback_frame = frame
+
+        while self.confirmed in remote:
+            self.confirmed += 1
+        return True
+
+    def can_advance(self):
+        # Function for checking if next frame can be simulated
+        # Simulation waits, if remote player is too far behind
+        return self.frame - self.confirmed < self.max_rollback
+
+    def synchronize(self):
+        # Function for simulating again frames with wrong predictions
+        if self.rollback_frame is None:
+            return
+        depth = self.frame - self.rollback_frame
+        self.rollbacks += 1
+        self.resimulated += depth
+        self.max_depth = max(self.max_depth, depth)
+
+        self.sim.restore(self.snapshots[self.rollback_frame])
+        for frame in range(self.rollback_frame, self.frame):
+            # Events were played in first simulation of frames
+            self.simulate(frame)
+        self.rollback_frame = None
+
+    def advance(self):
+        # Function for simulating next frame, returns events of frame
+        self.synchronize()
+        events = self.simulate(self.frame)
+        self.frame += 1
+
+        # Simulated frames before confirmed frame will never be rolled
+        # back, last confirmed remote mask is kept for prediction
+        last = min(self.confirmed, self.frame)
+        for frame in [frame for frame in self.snapshots if frame < last]:
+            del self.snapshots[frame]
+        remote = self.inputs[self.remote]
+        for frame in [frame for frame in remote if frame < last - 1]:
+            del remote[frame]
+        local = self.inputs[self.local]
+        for frame in [frame for frame in local
+                      if frame < min(last, self.acked)]:
+            del local[frame]
+        return events
+
+    def simulate(self, frame):
+        # Function for simulating frame with known or predicted masks
+        self.snapshots[frame] = self.sim.snapshot()
+        masks = [self.inputs[0].get(frame), self.inputs[1].get(frame)]
+        if masks[self.remote] is None:
+            # Remote tank repeats last known commands except fire
+            masks[self.remote] = self.inputs[self.remote].get(
+                self.confirmed - 1, 0
+            ) & ~main.REMOVE_MASK
+            self.predicted[frame] = masks[self.remote]
+        return self.sim.step(masks[0], masks[1])
+
+
+class LatencyInjector:
+    # Sender of packets with artificial delay, jitter and loss
+
+    def __init__(self, latency=0, jitter=0, loss=0, seed=None):
+        # latency, jitter parameters - in seconds
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.dropped = 0
+
+    def send(self, transport, data, addr):
+        # Function of sending packet with delay or dropping it
+        if self.loss and self.random.random() < self.loss:
+            self.dropped += 1
+            return
+        delay = self.latency + self.random.uniform(-self.jitter, self.jitter)
+        if delay <= 0:
+            transport.sendto(data, addr)
+        else:
+            asyncio.get_running_loop().call_later(delay, self.deliver,
+                                                  transport, data, addr)
+
+    def deliver(self, transport, data, addr):
+        # Function of sending delayed packet, if endpoint isn't closed
+        if not transport.is_closing():
+            transport.sendto(data, addr)
+
+
+class NetPeer(asyncio.DatagramProtocol):
+    # UDP endpoint of player, it sends and receives commands of session
+
+    def __init__(self, injector=None):
+        self.injector = injector or LatencyInjector()
+        self.transport = None
+        self.addr = None
+
+        # Session is created after handshake
+        self.session = None
+        self.started = asyncio.Event()
+        self.start_data = None
+        # Addresses of players with other protocol version
+        self.rejected = set()
+
+        # Frame of remote player and its time
+        self.remote_frame = 0
+        self.echo_time = 0
+        self.rtt = None
+
+        # Arrival times of remote masks by frames for measuring latency
+        self.arrivals = {}
+
+        self.sent = 0
+        self.received = 0
+
+    def frame_advantage(self):
+        # Function for getting count of frames, by which local player
+        # is ahead of remote player
+        if self.rtt is None:
+            return 0
+        return self.session.frame - self.remote_frame - \
+            self.rtt / 2 * main.TICK_RATE
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def send(self, data):
+        self.sent += 1
+        self.injector.send(self.transport, data, self.addr)
+
+    def datagram_received(self, data, addr):
+        if data[:2] != MAGIC or len(data) < 3:
+            return
+        self.received += 1
+        kind = data[2]
+        if kind == HELLO and self.start_data is not None:
+            version = data[3] if len(data) > 3 else None
+            if version != PROTOCOL_VERSION:
+                # HELLO is sent again, so player is reported once
+                if addr not in self.rejected:
+                    self.rejected.add(addr)
+                    print(f'Player {addr[0]}:{addr[1]} is rejected: '
+                          f'protocol version {version}, '
+                          f'expected {PROTOCOL_VERSION}')
+                return
+            # Player connected(or START was lost)
+            self.addr = addr
+            self.send(MAGIC + bytes((START,)) + self.start_data)
+            self.started.set()
+        elif kind == START and self.start_data is None:
+            self.start_data = data[3:]
+            self.started.set()
+        elif kind == INPUT and self.session is not None:
+            self.receive_inputs(data)
+
+    def receive_inputs(self, data):
+        # Function for adding remote masks from packet
+        _, _, ack, first, frame, send_time, echo_time, count = \
+            struct.unpack_from(INPUT_HEADER, data)
+        now = time.perf_counter()
+        session = self.session
+        session.acked = max(session.acked, ack)
+        if frame >= self.remote_frame:
+            self.remote_frame = frame
+            self.echo_time = send_time
+            if echo_time:
+                self.rtt = now - echo_time
+
+        masks = data[struct.calcsize(INPUT_HEADER):]
+        for i in range(min(count, len(masks))):
+            if session.add_remote_input(first + i, masks[i]):
+                self.arrivals[first + i] = now
+
+    def send_inputs(self):
+        # Function for sending local masks, which aren't acknowledged
+        session = self.session
+        inputs = session.inputs[session.local]
+        last = session.frame + session.input_delay
+        first = max(session.acked, last - MAX_BATCH, min(inputs))
+        masks = bytes(inputs.get(frame, 0) for frame in range(first, last))
+        self.send(struct.pack(INPUT_HEADER, MAGIC, INPUT, session.confirmed,
+                              first, session.frame, time.perf_counter(),
+                              self.echo_time, len(masks)) + masks)
+
+
+async def connect(host, port, injector, seed=None, level_names=None,
+                  local_port=0):
+    # Function of handshake of players
+    # Player with host=None waits for connection on port,
+    # other player connects to host and port
+    # Returns peer and session
+    loop = asyncio.get_running_loop()
+    peer = NetPeer(injector)
+    if host is None:
+        # Host chooses seed and levels of match
+        replay = main.Replay(random.getrandbits(64) if seed is None else seed,
+                             level_names or main.get_level_list())
+        peer.start_data = replay.pack()
+        await loop.create_datagram_endpoint(lambda: peer,
+                                            local_addr=('0.0.0.0', port))
+        await peer.started.wait()
+        local = 0
+    else:
+        peer.addr = (host, port)
+        await loop.create_datagram_endpoint(
+            lambda: peer, local_addr=('0.0.0.0', local_port)
+        )
+        # HELLO is sent again, until START comes
+        while not peer.started.is_set():
+            peer.send(MAGIC + bytes((HELLO, PROTOCOL_VERSION)))
+            try:
+                await asyncio.wait_for(peer.started.wait(), 0.2)
+            except asyncio.TimeoutError:
+                pass
+        replay = main.Replay.unpack(peer.start_data)
+        local = 1
+
+    replay.check_levels()
+    sim = main.Simulation(replay.seed, replay.level_names)
+    peer.session = RollbackSession(sim, local)
+    return peer, peer.session
+
+
+def percentiles(values, *points):
+    # Function for getting percentiles of values in milliseconds
+    values = sorted(values)
+    if not values:
+        return [None] * len(points)
+    return [values[min(len(values) - 1, int(len(values) * point / 100))]
+            * 1000 for point in points]
+
+
+class LatencyMeter:
+    # Measuring of time between sampling of commands and showing of frame,
+    # where commands are done
+
+    def __init__(self):
+        self.samples = {}
+        self.local = []
+        self.remote = []
+
+    def sample(self, frame):
+        # Function for saving time of sampling of local mask
+        self.samples[frame] = time.perf_counter()
+
+    def displayed(self, peer):
+        # Function for measuring latency after showing of frame
+        # Remote latency is time from arrival of mask to showing plus
+        # half of round trip time
+        now = time.perf_counter()
+        shown = peer.session.frame
+        for frame in [frame for frame in self.samples if frame < shown]:
+            self.local.append(now - self.samples.pop(frame))
+        for frame in [frame for frame in peer.arrivals if frame < shown]:
+            arrival = peer.arrivals.pop(frame)
+            if peer.rtt is not None:
+                self.remote.append(now - arrival + peer.rtt / 2)
+
+    def report(self, peer, stalls):
+        # Function for getting statistics of connection
+        session = peer.session
+        return {
+            'frames': session.frame,
+            'local_latency_ms': percentiles(self.local, 50, 95),
+            'remote_latency_ms': percentiles(self.remote, 50, 95),
+            'rtt_ms': None if peer.rtt is None else peer.rtt * 1000,
+            'rollbacks': session.rollbacks,
+            'resimulated_frames': session.resimulated,
+            'max_rollback': session.max_depth,
+            'stalls': stalls,
+            'packets_sent': peer.sent,
+            'packets_received': peer.received,
+            'packets_dropped': peer.injector.dropped,
+        }
+
+
+def print_report(name, report):
+    # Function for printing statistics of connection
+    print(f'{name}: frames {report["frames"]}, rtt '
+          f'{report["rtt_ms"] or 0:.1f} ms, rollbacks {report["rollbacks"]} '
+          f'(max {report["max_rollback"]} frames, '
+          f'{report["resimulated_frames"]} frames again), '
+          f'stalls {report["stalls"]}')
+    for kind in ('local', 'remote'):
+        p50, p95 = report[kind + '_latency_ms']
+        if p50 is not None:
+            print(f'    {kind} input-to-display latency: '
+                  f'p50 {p50:.1f} ms, p95 {p95:.1f} ms')
+    print(f'    packets: sent {report["packets_sent"]}, received '
+          f'{report["packets_received"]}, dropped by injector '
+          f'{report["packets_dropped"]}')
+
+
+async def play(peer, session, controller=None, frames=None, display=True):
+    # Main cycle of networked game, frames are run with TICK_RATE
+    # controller parameter - controller of local tank(by default local
+    # player can use keys of both players)
+    # frames parameter - count of frames to play(None - until exit)
+    loop = asyncio.get_running_loop()
+    sim = session.sim
+    meter = LatencyMeter()
+    booms = pygame.sprite.Group()
+    renderer = None
+    shown_round = None
+    if controller is None:
+        controller = main.KeyboardController({**main.PLAYER_1_KEYS,
+                                              **main.PLAYER_2_KEYS})
+    stalls = 0
+
+    next_time = loop.time()
+    while frames is None or session.frame < frames:
+        events = pygame.event.get() if display else []
+        for event in events:
+            if event.type == pygame.QUIT or (
+                    event.type == pygame.KEYDOWN and
+                    event.key == pygame.K_ESCAPE):
+                frames = session.frame
+        controller.update(events,
+                          pygame.key.get_pressed() if display else None)
+
+        # Skip frame, if remote player is too far behind,
+        # player, who is ahead, waits for other player
+        if session.can_advance() and peer.frame_advantage() < 2:
+            mask = controller.get_mask()
+            meter.sample(session.add_local_input(mask))
+            events = session.advance()
+            if display:
+                main.play_events(events, booms)
+        else:
+            session.synchronize()
+            stalls += 1
+        peer.send_inputs()
+
+        if display:
+            booms.update()
+            if (sim.round, sim.level_name) != shown_round:
+                shown_round = (sim.round, sim.level_name)
+                main.clear_booms(booms)
+                renderer = main.RoundRenderer(main.screen, sim)
+                renderer.draw_full()
+            renderer.draw(sim, booms)
+        meter.displayed(peer)
+
+        next_time += main.TICK
+        await asyncio.sleep(max(0, next_time - loop.time()))
+
+    # Remote player gets last commands, and last predictions are corrected
+    for _ in range(main.TICK_RATE):
+        peer.send_inputs()
+        if session.confirmed >= session.frame:
+            break
+        await asyncio.sleep(main.TICK)
+    session.synchronize()
+    main.clear_booms(booms)
+    return meter.report(peer, stalls)
+
+
+async def loopback(frames, latency, jitter, loss, seed):
+    # Function of playing match of two random players over loopback
+    # Returns statistics of both players and result of comparing
+    # their simulations
+    level_names = main.get_level_list()
+    injectors = [LatencyInjector(latency, jitter, loss, seed),
+                 LatencyInjector(latency, jitter, loss, seed + 1)]
+    port = 47000 + seed % 1000
+    host = asyncio.ensure_future(connect(None, port, injectors[0], seed,
+                                         level_names))
+    await asyncio.sleep(0.05)
+    guest = await connect('127.0.0.1', port, injectors[1])
+    host = await host
+
+    players = [main.RandomPlayer(seed * 2), main.RandomPlayer(seed * 2 + 1)]
+    reports = await asyncio.gather(*[
+        play(peer, session, player, frames, display=False)
+        for (peer, session), player in zip((host, guest), players)
+    ])
+    states = [peer.session.sim.snapshot() for peer, _ in (host, guest)]
+    for peer, _ in (host, guest):
+        peer.transport.close()
+        peer.session.sim.close()
+    return reports, states[0] == states[1]
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Play SquareTanks over network.'
+    )
+    parser.add_argument('mode', choices=['host', 'join', 'loopback'])
+    parser.add_argument('address', nargs='?',
+                        help='host:port of host(for join)')
+    parser.add_argument('--port', type=int, default=7777,
+                        help='port of host')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='artificial delay of sent packets in ms')
+    parser.add_argument('--jitter', type=float, default=0,
+                        help='random change of delay in ms')
+    parser.add_argument('--loss', type=float, default=0,
+                        help='part of sent packets, which are dropped')
+    parser.add_argument('--frames', type=int, default=600,
+                        help='frames of loopback match')
+    parser.add_argument('--seed', type=int,
+                        help='seed of match(random by default)')
+    args = parser.parse_args(argv)
+
+    latency = args.latency / 1000
+    jitter = min(args.jitter, args.latency) / 1000
+
+    if args.mode == 'loopback':
+        # Both players are played by random players without display
+        seed = args.seed if args.seed is not None else random.randrange(1000)
+        reports, identical = asyncio.run(
+            loopback(args.frames, latency, jitter, args.loss, seed)
+        )
+        print_report('host', reports[0])
+        print_report('guest', reports[1])
+        print(f'simulations are identical: {identical}')
+        return 0 if identical else 1
+
+    injector = LatencyInjector(latency, jitter, args.loss)
+    if args.mode == 'host':
+        host, port = None, args.port
+    else:
+        if not args.address:
+            parser.error('address of host is required for join')
+        host, port = args.address.rsplit(':', 1)
+        port = int(port)
+
+    main.init_game()
+    main.preloader.wait()
+
+    async def run():
+        pygame.display.set_caption('SquareTanks - waiting for player')
+        peer, session = await connect(host, port, injector, args.seed)
+        pygame.display.set_caption('SquareTanks')
+        try:
+            return await play(peer, session)
+        finally:
+            peer.transport.close()
+            session.sim.close()
+
+    print_report(args.mode, asyncio.run(run()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
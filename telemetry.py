@@ -0,0 +1,111 @@
+# Reader of telemetry files
+# Reads statistics of rounds, which are saved by game(--telemetry)
+# or match_runner.py, and prints statistics by levels
+#
+# Example:
+#     python telemetry.py rounds.stm
+#     python telemetry.py rounds.stm old_rounds.stm --json stats.json
+#     python telemetry.py rounds.stm --rounds 20
+
+import argparse
+import json
+import os
+import sys
+
+import main
+
+START_DIR = main.setup_headless()
+
+
+def summarize(rounds):
+    # Function for collecting statistics of rounds by levels
+    # Statistics of all levels are under name "all", generated levels
+    # are collected together
+    levels = {}
+    for record in rounds:
+        name = record['level']
+        if name.startswith(main.GENERATED_PREFIX):
+            name = main.GENERATED_LEVELS
+        for name in (name, 'all'):
+            level = levels.setdefault(name, {
+                'rounds': 0,
+                'draws': 0,
+                'duration': 0,
+                'time_to_kill': 0,
+                'shots': 0,
+                'bullet_hits': 0,
+                'block_hits': 0,
+            })
+            level['rounds'] += 1
+            level['draws'] += record['winner'] < 0
+            level['duration'] += record['duration']
+            level['time_to_kill'] += record['time_to_kill']
+            level['shots'] += sum(record['shots'])
+            level['bullet_hits'] += record['bullet_hits']
+            level['block_hits'] += record['block_hits']
+
+    # Sums of times are replaced by means
+    for level in levels.values():
+        level['mean_duration'] = level.pop('duration') / level['rounds']
+        level['mean_time_to_kill'] = level.pop('time_to_kill') / \
+            level['rounds']
+    return levels
+
+
+def print_summary(summary):
+    # Function for printing table of statistics by levels
+    print(f'{"level":<20}{"rounds":>7}{"draws":>7}{"round s":>9}'
+          f'{"kill s":>8}{"shots":>8}{"bullets":>9}{"blocks":>8}')
+    for name in sorted(summary, key=lambda name: (name == 'all', name)):
+        level = summary[name]
+        rounds = level['rounds']
+        print(f'{name:<20}{rounds:>7}{level["draws"]:>7}'
+              f'{level["mean_duration"]:>9.1f}'
+              f'{level["mean_time_to_kill"]:>8.1f}'
+              f'{level["shots"] / rounds:>8.1f}'
+              f'{level["bullet_hits"] / rounds:>9.1f}'
+              f'{level["block_hits"] / rounds:>8.1f}')
+
+
+def print_rounds(rounds):
+    # Function for printing table of rounds
+    print(f'{"seed":>16}{"round":>6}  {"level":<20}{"round s":>8}'
+          f'{"kill s":>8}{"winner":>7}  shots')
+    for record in rounds:
+        winner = record['winner'] + 1 if record['winner'] >= 0 else '-'
+        print(f'{record["seed"]:>16x}{record["round"]:>6}  '
+              f'{record["level"]:<20}{record["duration"]:>8.1f}'
+              f'{record["time_to_kill"]:>8.1f}{winner:>7}  '
+              f'{":".join(map(str, record["shots"]))}')
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Print statistics of SquareTanks telemetry files.'
+    )
+    parser.add_argument('files', nargs='+', help='telemetry files')
+    parser.add_argument('--rounds', type=int, metavar='N',
+                        help='print last N rounds too')
+    parser.add_argument('--json', help='file for statistics in JSON')
+    args = parser.parse_args(argv)
+
+    rounds = []
+    for path in args.files:
+        rounds += main.TelemetryWriter.read(os.path.join(START_DIR, path))
+    if not rounds:
+        print('No rounds')
+        return
+
+    summary = summarize(rounds)
+    print_summary(summary)
+    if args.rounds:
+        print()
+        print_rounds(rounds[-args.rounds:])
+
+    if args.json:
+        with open(os.path.join(START_DIR, args.json), 'w') as file:
+            json.dump({'levels': summary}, file, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli())